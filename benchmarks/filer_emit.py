@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of Filer.emit.
+
+Compares the previous implementation (json.dumps into a default-buffered
+text file, flushed every 100 tweets) with the current Filer for each
+available serializer.
+
+    python benchmarks/filer_emit.py -n 200000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twitter_tap import filer  # noqa: E402
+from twitter_tap.filer import Filer  # noqa: E402
+
+
+def sample_tweet(i):
+    return {
+        'created_at': 'Wed Oct 10 20:19:24 +0000 2018',
+        'id': 1050118621198921728 + i,
+        'id_str': str(1050118621198921728 + i),
+        'text': u'To make room for more expression, we will now count all emojis as equal — #%d' % i,
+        'source': '<a href="http://twitter.com" rel="nofollow">Twitter Web Client</a>',
+        'truncated': False,
+        'in_reply_to_status_id': None,
+        'user': {
+            'id': 6253282,
+            'id_str': '6253282',
+            'name': 'Twitter API',
+            'screen_name': 'TwitterAPI',
+            'location': 'San Francisco, CA',
+            'description': 'The Real Twitter API. Tweets about API changes, service issues and our Developer Platform.',
+            'followers_count': 6133636,
+            'friends_count': 12,
+            'created_at': 'Wed May 23 06:01:13 +0000 2007',
+            'profile_background_color': 'null',
+            'profile_link_color': 'null',
+            'verified': True,
+        },
+        'coordinates': None,
+        'entities': {'hashtags': [{'text': str(i), 'indices': [76, 80]}], 'urls': [], 'user_mentions': []},
+        'lang': 'en',
+    }
+
+
+class LegacyFiler:
+    """ The emit loop as it was before the serializer hook """
+
+    def __init__(self, file_name):
+        self.file = open(file_name, 'w')
+        self.counter = 0
+        self.flush_every = 100
+
+    def emit(self, dict_entry):
+        self.file.write(json.dumps(dict_entry) + "\n")
+        self.counter += 1
+        if self.counter % self.flush_every == 0:
+            self.file.flush()
+
+    def close_file(self):
+        self.file.close()
+
+
+def run(name, writer, tweets, directory):
+    start = time.time()
+    for tweet in tweets:
+        writer.emit(tweet)
+    writer.close_file()
+    elapsed = time.time() - start
+    size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(directory) for f in files)
+    print("%-24s %10.0f tweets/s %8.1f MB/s" % (name, len(tweets) / elapsed, size / elapsed / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Filer.emit')
+    parser.add_argument('-n', '--number', type=int, default=100000, help='Number of tweets to write.')
+    args = parser.parse_args()
+
+    tweets = [sample_tweet(i) for i in range(args.number)]
+    serializers = [('json', lambda obj: json.dumps(obj).encode('utf-8'))]
+    for module in ('ujson', 'orjson'):
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        serializers.append((module, None))
+
+    root = tempfile.mkdtemp()
+    try:
+        directory = os.path.join(root, 'legacy')
+        os.makedirs(directory)
+        run('legacy', LegacyFiler(os.path.join(directory, 'out.txt')), tweets, directory)
+
+        for name, serializer in serializers:
+            directory = os.path.join(root, name)
+            if serializer is None:
+                module = __import__(name)
+                serializer = module.dumps if name == 'orjson' else (lambda obj, m=module: m.dumps(obj).encode('utf-8'))
+            run('Filer.emit (%s)' % name, Filer(directory, args.number + 1, serializer=serializer), tweets, directory)
+
+        directory = os.path.join(root, 'default')
+        run('Filer.emit (default)', Filer(directory, args.number + 1), tweets, directory)
+        print("default serializer: %s" % filer.dumps.__module__)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
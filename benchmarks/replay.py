@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Offline replay benchmark of the stream and search code paths.
+
+Recorded tweets, e.g. the .txt files written by Filer, are replayed through
+the unmodified `tap` command: a fake transport adapter stands in for
+api.twitter.com and stream.twitter.com, and MongoDB is either mongomock or
+a local mongod. Every scenario runs in its own process and reports the
+sustained tweets/s, the latency from the moment a tweet leaves the fake
+transport until its sink accepted it, and the peak RSS.
+
+mongomock checks unique indexes and finds the documents to upsert by
+scanning the whole collection, so it slows down with every stored tweet.
+The Mongo scenarios therefore create no indexes on mongomock, and the
+upserts of search-mongo are still bound by mongomock. Use --db for numbers
+that measure tap rather than the stand-in.
+
+    python benchmarks/replay.py data/2026/10/ --rate 5000
+    python benchmarks/replay.py --generate 50000 --db mongodb://localhost:27017/tap_benchmark
+    python benchmarks/replay.py --generate 50000 --scenario stream-file --tap-args "--writers 2"
+"""
+
+import argparse
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shlex
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ['stream-mongo', 'stream-file', 'stream-passthrough', 'search-mongo', 'search-file']
+CREDENTIALS = ['-ck', 'key', '-cs', 'secret', '-at', 'token']
+
+
+def read_lines(paths):
+    """ Yields the raw lines of Filer output files, also below directories """
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            files = [path]
+        for name in files:
+            if name.endswith('.txt'):
+                f = open(name, 'rb')
+            elif name.endswith('.txt.gz'):
+                f = gzip.open(name, 'rb')
+            elif name.endswith('.txt.zst'):
+                import zstandard
+                f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(name, 'rb')))
+            else:
+                continue
+            with f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield line
+
+
+def load_tweets(args):
+    """ Returns the replayed tweets as a list of (id, raw line) sorted by id """
+    if args.generate:
+        from filer_emit import sample_tweet
+        lines = (json.dumps(sample_tweet(i), separators=(',', ':')).encode('utf-8') for i in range(args.generate))
+    else:
+        lines = read_lines(args.paths)
+    tweets = {}
+    for line in lines:
+        status = json.loads(line.decode('utf-8'))
+        if 'id' in status and 'text' in status:
+            tweets[status['id']] = line
+        if args.limit and len(tweets) >= args.limit:
+            break
+    return sorted(tweets.items())
+
+
+class Replay:
+    """ Serves the recorded tweets at a controlled rate and remembers when each one was served """
+
+    def __init__(self, tweets, rate):
+        self.tweets = tweets
+        self.newest_first = list(reversed(tweets))
+        self.rate = rate
+        self.served = {}
+        self.started = None
+        self.exhausted = False
+
+    def pace(self):
+        now = time.time()
+        if self.started is None:
+            self.started = now
+        if self.rate:
+            delay = self.started + len(self.served) / float(self.rate) - now
+            if delay > 0:
+                time.sleep(delay)
+
+    def stream_lines(self):
+        for tweet_id, line in self.tweets:
+            self.pace()
+            self.served[tweet_id] = time.time()
+            yield line + b'\r\n'
+        self.exhausted = True
+
+    def search_page(self, params, count=100):
+        since_id = int(params.get('since_id', ['0'])[0])
+        max_id = int(params.get('max_id', [str(2 ** 63)])[0])
+        page = [(i, line) for i, line in self.newest_first if since_id < i <= max_id][:count]
+        for tweet_id, _ in page:
+            self.pace()
+            self.served.setdefault(tweet_id, time.time())
+        metadata = {'refresh_url': '?since_id=' + str(page[0][0] if page else since_id)}
+        if page and any(since_id < i < page[-1][0] for i, _ in self.newest_first):
+            metadata['next_results'] = '?max_id=' + str(page[-1][0] - 1)
+        else:
+            self.exhausted = True
+        return (b'{"statuses":[' + b','.join(line for _, line in page) + b'],"search_metadata":' +
+                json.dumps(metadata).encode('utf-8') + b'}')
+
+
+class StreamBody(io.RawIOBase):
+    def __init__(self, lines):
+        self.lines = lines
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return next(self.lines, b'')
+
+
+def install_transport(replay):
+    """ Routes every request made through requests to the replay """
+    import requests
+    from requests.adapters import BaseAdapter
+    from requests.structures import CaseInsensitiveDict
+    from six.moves.urllib import parse as urlparse
+
+    class ReplayAdapter(BaseAdapter):
+        def send(self, request, stream=False, **kwargs):
+            if replay.exhausted:
+                # the stream reconnected or a new search started: everything was delivered
+                os.kill(os.getpid(), signal.SIGTERM)
+                time.sleep(60)
+            url = urlparse.urlparse(request.url)
+            response = requests.Response()
+            response.status_code = 200
+            response.url = request.url
+            response.request = request
+            response.encoding = 'utf-8'
+            response.headers = CaseInsensitiveDict({'x-rate-limit-remaining': '450',
+                                                    'x-rate-limit-reset': str(int(time.time()) + 900)})
+            if url.netloc.startswith('stream.'):
+                response.raw = StreamBody(replay.stream_lines())
+            else:
+                response.raw = io.BytesIO(replay.search_page(urlparse.parse_qs(url.query)))
+            return response
+
+        def close(self):
+            pass
+
+    adapter = ReplayAdapter()
+    requests.Session.get_adapter = lambda session, url: adapter
+
+
+def install_sink_probes(written):
+    """ Records when each tweet id was accepted by a sink """
+    from twitter_tap import filer
+    from twitter_tap.passthrough import tweet_id
+    import pymongo.collection
+
+    def probe(cls, name, ids):
+        original = getattr(cls, name)
+
+        def wrapper(self, payload, *args, **kwargs):
+            result = original(self, payload, *args, **kwargs)
+            now = time.time()
+            for i in ids(payload):
+                written.setdefault(i, now)
+            return result
+
+        setattr(cls, name, wrapper)
+
+    probe(filer.Filer, 'emit', lambda status: [status['id']])
+    probe(filer.Filer, 'emit_raw', lambda line: [tweet_id(line)])
+    try:
+        from twitter_tap.parquet import ParquetFiler
+        probe(ParquetFiler, 'emit', lambda status: [status['id']])
+    except ImportError:
+        pass
+    collections = [pymongo.collection.Collection]
+    try:
+        import mongomock
+        collections.append(mongomock.collection.Collection)
+    except ImportError:
+        pass
+    for cls in collections:
+        probe(cls, 'insert_many', lambda docs: [doc['id'] for doc in docs])
+        probe(cls, 'bulk_write', lambda ops: [getattr(op, '_doc', {}).get('id') for op in ops])
+
+
+def tap_arguments(scenario, options, output_dir):
+    mode, sink = scenario.split('-')
+    arguments = shlex.split(options.tap_args)
+    if sink == 'mongo' and options.db == 'mongomock':
+        # mongomock enforces a unique index with a scan of the collection, --tap-args can still set them
+        arguments = ['--indexes', ''] + arguments
+    if sink in ('file', 'passthrough'):
+        arguments = ['-o', output_dir] + arguments
+    if mode == 'stream':
+        arguments += ['stream'] + CREDENTIALS + ['-ats', 'secret', '-t', 'replay']
+        if sink == 'passthrough':
+            arguments.append('--passthrough')
+    else:
+        arguments += ['search'] + CREDENTIALS + ['-q', 'replay']
+    if sink == 'mongo':
+        arguments += ['--db', options.db if options.db != 'mongomock' else 'mongodb://localhost:27017/tap_benchmark']
+    return ['tap'] + arguments + shlex.split(options.sub_args) + ['-v', options.loglevel]
+
+
+def run_scenario(scenario, options, results):
+    tweets = load_tweets(options)
+    replay = Replay(tweets, options.rate)
+    written = {}
+    output_dir = tempfile.mkdtemp()
+
+    import pymongo
+    if options.db == 'mongomock':
+        import mongomock
+        client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *args, **kwargs: client
+    else:
+        client = pymongo.MongoClient(options.db)
+        client.drop_database(pymongo.uri_parser.parse_uri(options.db)['database'])
+
+    install_transport(replay)
+    install_sink_probes(written)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    from twitter_tap import tap
+    sys.argv = tap_arguments(scenario, options, output_dir)
+    try:
+        tap.main()
+    except SystemExit:
+        pass
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    latencies = sorted(written[i] - replay.served[i] for i in written if i in replay.served)
+    elapsed = (max(written.values()) - replay.started) if written else 0.0
+    results.put({
+        'scenario': scenario,
+        'served': len(replay.served),
+        'written': len(written),
+        'tweets_per_second': len(written) / elapsed if elapsed else 0.0,
+        'latency': dict((p, latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))] * 1000.0)
+                        for p in (50, 90, 99)) if latencies else {},
+        'baseline_rss': baseline / 1024.0,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded tweets through the tap stream and search code paths.')
+    parser.add_argument('paths', nargs='*', help='Filer output files or directories to replay.')
+    parser.add_argument('--generate', type=int, default=0, help='Replay this many synthetic tweets instead of files.')
+    parser.add_argument('--limit', type=int, default=0, help='Replay at most this many tweets.')
+    parser.add_argument('--rate', type=float, default=0, help='Tweets per second to serve, 0 for as fast as possible.')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='Scenarios to run, default is all.')
+    parser.add_argument('--db', default='mongomock', help='mongomock, or the URI of a local mongod. Its database is dropped first!')
+    parser.add_argument('--tap-args', default='', help='Extra global tap options, e.g. "--writers 2 --seen-cache lru".')
+    parser.add_argument('--sub-args', default='', help='Extra stream/search options, e.g. "--batch-size 1000".')
+    parser.add_argument('-v', '--verbosity', dest='loglevel', default='ERROR', help='Log level of tap.')
+    options = parser.parse_args()
+    if not options.paths and not options.generate:
+        parser.error('Pass files to replay or --generate N.')
+
+    context = multiprocessing.get_context('spawn')
+    print("%-20s %9s %9s %11s %9s %9s %9s %10s" % ('scenario', 'served', 'written', 'tweets/s', 'p50 ms', 'p90 ms',
+                                                  'p99 ms', 'peak RSS'))
+    for scenario in options.scenario or SCENARIOS:
+        results = context.Queue()
+        process = context.Process(target=run_scenario, args=(scenario, options, results))
+        process.start()
+        result = None
+        while result is None:
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+        process.join()
+        if result is None:
+            print("%-20s failed with exit code %s" % (scenario, process.exitcode))
+            continue
+        latency = result['latency']
+        print("%-20s %9d %9d %11.0f %9.2f %9.2f %9.2f %7.0f MB" % (
+            scenario, result['served'], result['written'], result['tweets_per_second'], latency.get(50, 0),
+            latency.get(90, 0), latency.get(99, 0), result['peak_rss']))
+        if scenario == 'search-mongo' and options.db == 'mongomock':
+            print("    mongomock scans the collection for every upsert, use --db to measure tap")
+        if result['written'] < result['served']:
+            print("    %d tweets were not written" % (result['served'] - result['written']))
+        print("    %.0f MB of the peak RSS were used before tap started" % result['baseline_rss'])
+
+
+if __name__ == "__main__":
+    main()
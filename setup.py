@@ -27,6 +27,13 @@ dist = setup(
     url='http://janezkranjc.github.io/twitter-tap/',
     license='MIT',
     install_requires=['pymongo', 'twython', 'six'],
+    extras_require={
+        'zstd': ['zstandard'],
+        'fast': ['orjson'],
+        'async': ['aiohttp', 'motor', 'oauthlib'],
+        'parquet': ['pyarrow'],
+        'match': ['pyahocorasick'],
+    },
     classifiers=CLASSIFIERS,
     packages=find_packages(),
     include_package_data=True,
@@ -0,0 +1,26 @@
+import importlib
+
+# name: module, the modules are only imported once a name is used so that the tap command starts fast
+_EXPORTS = {
+    'Archive': 'archive',
+    'Connections': 'collector',
+    'SearchCollector': 'collector',
+    'StreamCollector': 'collector',
+    'Sink': 'sinks',
+    'MongoSink': 'sinks',
+    'FileSink': 'sinks',
+    'RoutingSink': 'sinks',
+    'Filer': 'filer',
+    'Partitioner': 'partition',
+    'Matcher': 'matcher',
+    'Projection': 'transform',
+    'SpoolingWriter': 'spool',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module " + __name__ + " has no attribute " + name)
+    return getattr(importlib.import_module('.' + _EXPORTS[name], __name__), name)
@@ -0,0 +1,515 @@
+import asyncio
+import json
+import logging
+import signal
+import time
+
+import aiohttp
+import pymongo
+from oauthlib.oauth1 import Client as OAuth1Client
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from six.moves.urllib.parse import urlencode
+
+from . import metrics
+from .partition import index_spec
+from .passthrough import message_type, tweet_id
+from .pipeline import Pipeline, POLICIES, BLOCK, DROP_NEWEST
+from .scheduler import backoff_delay, next_max_id
+from .storage import only_duplicates, report_insert
+from .transform import convert_dates
+
+logger = logging.getLogger('twitter')
+
+SEARCH_URL = 'https://api.twitter.com/1.1/search/tweets.json'
+STREAM_URL = 'https://stream.twitter.com/1.1/statuses/'
+
+_STOP = object()
+
+
+class AsyncPipeline:
+    """ The asyncio counterpart of Pipeline: items are handed to `writers` writer
+    tasks through a bounded queue, with the same queue policies.
+    """
+
+    def __init__(self, handler, maxsize=10000, writers=1, policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy: " + str(policy))
+        self.handler = handler  # a coroutine function
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.failures = 0  # items whose handler raised an error
+        self.tasks = [asyncio.ensure_future(self._work()) for i in range(writers)]
+
+    async def put(self, item):
+        if not self.tasks:
+            await self._handle(item)
+            return
+        if self.policy == BLOCK:
+            await self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.policy == DROP_NEWEST:
+                self._drop(item)
+                return
+            oldest = self.queue.get_nowait()
+            self.queue.task_done()
+            self._drop(oldest)
+            self.queue.put_nowait(item)
+
+    async def join(self):
+        """ Waits until every item put so far has been handled, returns the number of failed items
+        like Pipeline.join
+        """
+        await self.queue.join()
+        return self.failures
+
+    def depth(self):
+        return self.queue.qsize()
+
+    async def close(self):
+        """ Drains the queue and stops the writer tasks
+        """
+        for task in self.tasks:
+            await self.queue.put(_STOP)
+        await asyncio.gather(*self.tasks)
+        self.tasks = []
+
+    _drop = Pipeline._drop
+
+    async def _handle(self, item):
+        try:
+            await self.handler(item)
+        except Exception as e:
+            self.failures += 1
+            metrics.WRITE_ERRORS.inc()
+            logger.error("Couldn't save: " + str(e))
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                await self._handle(item)
+            finally:
+                self.queue.task_done()
+
+
+class AsyncBatchWriter:
+    """ The asyncio counterpart of BatchWriter, inserting into a Motor collection.
+    While a batch is being inserted the next one is already being collected.
+    """
+
+    def __init__(self, collection, size=500, max_age=1.0):
+        self.collection = collection
+        self.size = size
+        self.max_age = max_age
+        self.buffer = []
+        self.started = None  # arrival time of the oldest buffered tweet
+        self.flusher = asyncio.ensure_future(self._flush_stale())
+
+    async def write(self, doc):
+        if not self.buffer:
+            self.started = time.time()
+        self.buffer.append(doc)
+        if len(self.buffer) >= self.size or time.time() - self.started >= self.max_age:
+            await self.flush()
+
+    def depth(self):
+        return len(self.buffer)
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        started = time.time()
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+        except Exception as e:
+            report_insert(batch, started, e)
+        else:
+            report_insert(batch, started)
+
+    async def close(self):
+        self.flusher.cancel()
+        await self.flush()
+
+    async def _flush_stale(self):
+        while True:
+            await asyncio.sleep(self.max_age)
+            if self.buffer and time.time() - self.started >= self.max_age:
+                await self.flush()
+
+
+async def bulk_upsert(collection, statuses):
+    """ The asyncio counterpart of storage.bulk_upsert
+    """
+    if not statuses:
+        return
+    requests = [ReplaceOne({'id': status['id']}, status, upsert=True) for status in statuses]
+    started = time.time()
+    try:
+        await collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        if not only_duplicates(e):
+            raise
+        logger.debug("Skipped " + str(len(e.details['writeErrors'])) + " duplicate tweets.")
+    metrics.WRITE_SECONDS.observe(time.time() - started)
+    metrics.WRITTEN.inc(len(statuses))
+
+
+class AsyncSearch:
+    """ Runs the queries of a QueryScheduler on `fetchers` concurrent tasks of one
+    event loop, so requests for many queries and the writes of their pages overlap.
+    Pages are handed to `pipeline`, and as with the threaded engine the since_id of
+    a query only advances once all pages of its chain are stored.
+    """
+
+    def __init__(self, scheduler, budget, access_token, pipeline, queries=None, result_type='mixed', waittime=0.0,
+                 checkpoint=False, seen=None):
+        self.scheduler = scheduler
+        self.budget = budget
+        self.access_token = access_token
+        self.pipeline = pipeline
+        self.queries = queries  # Motor collection of the query state, None when writing to files
+        self.result_type = result_type
+        self.waittime = waittime
+        self.checkpoint = checkpoint
+        self.seen = seen
+        self.released = asyncio.Event()
+
+    async def run(self, fetchers=1):
+        headers = {'Authorization': 'Bearer ' + self.access_token}
+        async with aiohttp.ClientSession(headers=headers, timeout=aiohttp.ClientTimeout(total=60)) as session:
+            await asyncio.gather(*[self.fetch(session) for i in range(fetchers)])
+
+    async def fetch(self, session):
+        while True:
+            search_query = await self.acquire()
+            received = 0
+            try:
+                if search_query.max_id:
+                    logger.debug("Continuing " + repr(search_query) + " at max_id " + str(search_query.max_id))
+                received = await self.search_page(session, search_query)
+            finally:
+                self.scheduler.release(search_query, received)
+                self.released.set()
+
+    async def acquire(self):
+        while True:
+            search_query, wait = self.scheduler.poll()
+            if search_query:
+                return search_query
+            self.released.clear()
+            try:
+                await asyncio.wait_for(self.released.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def perform_query(self, session, **params):
+        params = dict((key, value) for key, value in params.items() if value is not None)
+        attempt = 0
+        while True:
+            if self.waittime:
+                await asyncio.sleep(self.waittime)
+            wait = self.budget.try_acquire()
+            if wait:
+                logger.info("Request budget used up, waiting " + str(int(wait)) + " seconds for the window to reset...")
+                await asyncio.sleep(wait)
+                continue
+            try:
+                async with session.get(SEARCH_URL, params=params) as response:
+                    remaining = response.headers.get('x-rate-limit-remaining')
+                    reset = response.headers.get('x-rate-limit-reset')
+                    if response.status == 429:
+                        logger.warning("Rate limit reached, waiting for the rate limit window to reset...")
+                        self.budget.exhausted(reset)
+                        continue
+                    response.raise_for_status()
+                    results = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+                delay = backoff_delay(attempt)
+                attempt += 1
+                logger.error("Some other error occured, taking a break for " + str(int(delay)) + " seconds: " + str(err))
+                await asyncio.sleep(delay)
+                continue
+            self.budget.update(remaining, reset)
+            if remaining is not None:
+                metrics.RATE_LIMIT_REMAINING.set(int(remaining))
+            return results
+
+    async def search_page(self, session, search_query):
+        """ Fetches and queues the next page of a query, see SearchCollector.search_page in collector.py.
+        Returns the number of new tweets.
+        """
+        if not search_query.max_id:
+            search_query.failures = self.pipeline.failures
+        results = await self.perform_query(session, q=search_query.query, geocode=search_query.geocode,
+                                           lang=search_query.lang, count=100, since_id=search_query.since_id,
+                                           max_id=search_query.max_id, result_type=self.result_type)
+        statuses = results['statuses']
+        metrics.RECEIVED.inc(len(statuses))
+
+        current_since_id = int(search_query.next_since_id or search_query.since_id or 0)
+        for status in statuses:
+            current_since_id = max(current_since_id, int(status['id']))
+        if self.seen:
+            statuses = [status for status in statuses if not self.seen.contains(status['id'])]
+        if statuses:
+            await self.pipeline.put(statuses)
+            logger.debug("Received " + str(len(statuses)) + " tweets.")
+        else:
+            logger.debug("No new tweets.")
+        search_query.next_since_id = str(current_since_id)
+        search_query.max_id = next_max_id(results)
+
+        if search_query.max_id:
+            if self.checkpoint and self.queries is not None:
+                if not await self.stored(search_query):
+                    return len(statuses)
+                await self.queries.update_one(search_query.key(),
+                                              {"$set": {'max_id': search_query.max_id,
+                                                        'next_since_id': search_query.next_since_id}},
+                                              upsert=True)
+        elif self.queries is not None:
+            if not await self.stored(search_query):
+                return len(statuses)
+            search_query.since_id = search_query.next_since_id
+            search_query.next_since_id = None
+            await self.queries.update_one(search_query.key(),
+                                          {"$set": {'since_id': search_query.since_id},
+                                           "$unset": {'max_id': "", 'next_since_id': ""}},
+                                          upsert=True)
+        else:
+            search_query.since_id = search_query.next_since_id
+            search_query.next_since_id = None
+        return len(statuses)
+
+    async def stored(self, search_query):
+        """ See SearchCollector.stored in collector.py
+        """
+        if await self.pipeline.join() == search_query.failures:
+            return True
+        logger.error("Not all tweets of " + repr(search_query) + " were stored, fetching them again.")
+        search_query.max_id = None
+        search_query.next_since_id = None
+        return False
+
+
+class AsyncStream:
+    """ Reads an endpoint of the streaming API with aiohttp and hands the tweets to
+    `pipeline`. Every connection is signed with OAuth 1.0a, and the stream is
+    reconnected with a growing delay when it fails.
+    """
+
+    def __init__(self, consumer_key, consumer_secret, access_token, access_token_secret, pipeline,
+                 passthrough=False, seen=None):
+        self.oauth = OAuth1Client(consumer_key, client_secret=consumer_secret, resource_owner_key=access_token,
+                                  resource_owner_secret=access_token_secret)
+        self.pipeline = pipeline
+        self.passthrough = passthrough  # hand over the raw lines instead of the decoded tweets
+        self.seen = seen
+
+    def sign(self, method, url, params):
+        body = None
+        headers = {}
+        if method == 'POST':
+            body = urlencode(params)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif params:
+            url += '?' + urlencode(params)
+        return self.oauth.sign(url, http_method=method, body=body, headers=headers)
+
+    async def run(self, endpoint, params=None):
+        """ Reads the filter, sample or firehose endpoint until the task is cancelled
+        """
+        method = 'POST' if endpoint == 'filter' else 'GET'
+        params = dict((key, value) for key, value in (params or {}).items() if value is not None)
+        # Twitter sends a keep-alive newline every 30 seconds
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=90)
+        attempt = 0
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while True:
+                uri, headers, body = self.sign(method, STREAM_URL + endpoint + '.json', params)
+                base = 2.0
+                try:
+                    async with session.request(method, uri, headers=headers, data=body) as response:
+                        metrics.on_connect(response)
+                        if response.status != 200:
+                            logger.error("Received error code " + str(response.status) + ".")
+                            if response.status == 420:
+                                base = 60.0  # the connection is rate limited
+                        else:
+                            attempt = 0
+                            await self.read(response)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.error("Lost the connection to the streaming API: " + str(e))
+                delay = backoff_delay(attempt, base)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def read(self, response):
+        rest = b''
+        async for chunk in response.content.iter_any():
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                line = line.strip()
+                if line:
+                    await self.on_line(line)
+
+    async def on_line(self, line):
+        if self.passthrough:
+            kind = message_type(line)
+            if kind == 'tweet':
+                metrics.RECEIVED.inc()
+                if not (self.seen and self.seen.check_and_add(tweet_id(line))):
+                    await self.pipeline.put(line)
+                return
+            if kind is None:
+                return
+        data = json.loads(line.decode('utf-8'))
+        if 'text' in data:
+            metrics.RECEIVED.inc()
+            if not (self.seen and self.seen.check_and_add(data['id'])):
+                await self.pipeline.put(data)
+        if 'limit' in data:
+            metrics.LIMIT_NOTICES.inc()
+            if isinstance(data['limit'], dict) and 'track' in data['limit']:
+                metrics.UNDELIVERED.set(data['limit']['track'])
+            logger.warning("The filtered stream has matched more Tweets than its current rate limit allows it to be delivered.")
+
+
+async def _connect(uri):
+    # motor is only needed when the tweets are stored in MongoDB
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(uri)
+    db = client[pymongo.uri_parser.parse_uri(uri)['database']]
+    return client, db
+
+
+async def search(args, scheduler, budget, access_token, file_writer=None, projection=None, seen=None):
+    client = None
+    queries = None
+    if not file_writer:
+        client, db = await _connect(args.dburi)
+        queries = db[args.queries_collection]
+        tweets = db[args.tweets_collection]
+
+    async def store_tweets(statuses):
+        ids = [status['id'] for status in statuses]
+        if projection:
+            statuses = [projection.apply(status) for status in statuses]
+        if file_writer:
+            for status in statuses:
+                file_writer.emit(status)
+        else:
+            await bulk_upsert(tweets, [convert_dates(status) for status in statuses])
+        if seen:
+            # as in SearchCollector.store, the tweets of a failed page are stored when it is fetched again
+            for status_id in ids:
+                seen.add(status_id)
+
+    pipeline = AsyncPipeline(store_tweets, maxsize=args.queue_size, writers=args.writers, policy=args.queue_policy)
+    metrics.QUEUE_DEPTH.set_function(pipeline.depth)
+    collector = AsyncSearch(scheduler, budget, access_token, pipeline, queries, result_type=args.result_type,
+                            waittime=args.waittime, checkpoint=args.checkpoint, seen=seen)
+    logger.info("Collecting tweets for " + str(len(scheduler.queries)) + " queries from the search API...")
+    try:
+        await collector.run(args.fetchers)
+    finally:
+        await _shutdown(pipeline, None, file_writer, seen, client)
+
+
+async def stream(args, file_writer=None, projection=None, seen=None, matcher=None):
+    client = None
+    batch_writer = None
+    if not file_writer:
+        client, db = await _connect(args.dburi)
+        tweets = db[args.tweets_collection]
+        for field in [field.strip() for field in args.indexes.split(',') if field.strip()]:
+            keys, options = index_spec(field)
+            await tweets.create_index(keys, **options)
+        if args.ttl:
+            await tweets.create_index([('created_at', pymongo.ASCENDING)], expireAfterSeconds=args.ttl * 24 * 60 * 60)
+        batch_writer = AsyncBatchWriter(tweets, size=args.batch_size, max_age=args.batch_age)
+        metrics.BUFFER_DEPTH.set_function(batch_writer.depth)
+
+    async def store_tweet(data):
+        if args.passthrough:
+            file_writer.emit_raw(data)
+            return
+        if matcher:
+            matched_terms = matcher.match(data)
+        if projection:
+            data = projection.apply(data)
+        if matcher:
+            data['matched_terms'] = matched_terms
+        if file_writer:
+            file_writer.emit(data)
+        else:
+            await batch_writer.write(convert_dates(data))
+
+    pipeline = AsyncPipeline(store_tweet, maxsize=args.queue_size, writers=args.writers, policy=args.queue_policy)
+    metrics.QUEUE_DEPTH.set_function(pipeline.depth)
+    streamer = AsyncStream(args.consumer_key, args.consumer_secret, args.access_token, args.access_token_secret,
+                           pipeline, passthrough=args.passthrough, seen=seen)
+    if args.follow or args.track or args.locations:
+        endpoint, params = 'filter', {'follow': args.follow, 'track': args.track, 'locations': args.locations}
+    else:
+        endpoint, params = 'firehose' if args.firehose else 'sample', None
+
+    logger.info("Collecting tweets from the streaming API...")
+    try:
+        await streamer.run(endpoint, params)
+    finally:
+        await _shutdown(pipeline, batch_writer, file_writer, seen, client)
+
+
+async def _shutdown(pipeline, batch_writer, file_writer, seen, client):
+    if seen:
+        logger.info(seen.stats())
+    await pipeline.close()
+    if batch_writer:
+        await batch_writer.close()
+    if file_writer:
+        file_writer.close_file()
+    if client:
+        client.close()
+
+
+async def _main(coroutine):
+    loop = asyncio.get_event_loop()
+    task = asyncio.ensure_future(coroutine)
+
+    def shutdown():
+        logger.warning("Shutdown signal received! Shutting down.")
+        # a second signal while the queues are drained stops the process right away
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+            signal.signal(signum, signal.SIG_DFL)
+        task.cancel()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, shutdown)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def run_search(args, scheduler, budget, access_token, file_writer=None, projection=None, seen=None):
+    """ Runs the search subcommand on the asyncio engine until a shutdown signal arrives
+    """
+    asyncio.run(_main(search(args, scheduler, budget, access_token, file_writer, projection, seen)))
+
+
+def run_stream(args, file_writer=None, projection=None, seen=None, matcher=None):
+    """ Runs the stream subcommand on the asyncio engine until a shutdown signal arrives
+    """
+    asyncio.run(_main(stream(args, file_writer, projection, seen, matcher)))
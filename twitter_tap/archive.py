@@ -0,0 +1,215 @@
+import bisect
+import collections
+import datetime
+import gzip
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from .loader import find_files, loads, open_file
+
+logger = logging.getLogger('twitter')
+
+# an index starts with its magic, the number of blocks and the number of tweets, then come the
+# blocks as (offset, length) in the archive and the tweets as (id, block, offset in the block) sorted by id
+MAGIC = b'TAPIDX01'
+HEADER = struct.Struct('<8sIQ')
+BLOCK = struct.Struct('<QI')
+RECORD = struct.Struct('<QII')
+ID = struct.Struct('<Q')
+
+ARCHIVE_EXTENSION = '.archive.txt.gz'
+INDEX_EXTENSION = '.archive.idx'
+
+
+def archive_paths(day_directory):
+    """ Returns the paths of the archive and the index of a year/month/day folder written by Filer
+    """
+    day = '-'.join(os.path.normpath(day_directory).split(os.sep)[-3:])
+    return (os.path.join(day_directory, day + ARCHIVE_EXTENSION),
+            os.path.join(day_directory, day + INDEX_EXTENSION))
+
+
+def find_days(directory):
+    """ Returns the year/month/day folders below `directory` as (date, path), oldest first
+    """
+    days = []
+    for year in sorted(os.listdir(directory)):
+        for month in sorted(os.listdir(os.path.join(directory, year))) if year.isdigit() else []:
+            for day in sorted(os.listdir(os.path.join(directory, year, month))) if month.isdigit() else []:
+                path = os.path.join(directory, year, month, day)
+                try:
+                    date = datetime.date(int(year), int(month), int(day))
+                except ValueError:
+                    continue
+                if os.path.isdir(path):
+                    days.append((date, path))
+    return days
+
+
+def compact(day_directory, block_size=1000, level=6, remove=False):
+    """ Merges the files of a day into one archive of gzip members holding `block_size` tweets each,
+    so a single tweet is read by decompressing only its block, and writes the index of the tweets
+    next to it. A tweet stored several times is archived once. With `remove` the merged files are
+    deleted. Returns the number of archived tweets.
+    """
+    archive_path, index_path = archive_paths(day_directory)
+    # an archive compacted again is read as one of the files of the day
+    sources = find_files(day_directory)
+    blocks = []  # (offset, length)
+    records = []  # (id, block, offset in the block)
+    seen = set()
+    lines = []
+    size = 0
+
+    archive = open(archive_path + '.tmp', 'wb')
+
+    def write_block():
+        data = gzip.compress(b''.join(lines), level, mtime=0)
+        blocks.append((archive.tell(), len(data)))
+        archive.write(data)
+
+    try:
+        for path in sources:
+            with open_file(path) as f:
+                for number, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        status_id = int(loads(line)['id'])
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning("Skipped the invalid line " + str(number) + " of " + path + ".")
+                        continue
+                    if status_id in seen:
+                        continue
+                    seen.add(status_id)
+                    records.append((status_id, len(blocks), size))
+                    lines.append(line + b'\n')
+                    size += len(line) + 1
+                    if len(lines) >= block_size:
+                        write_block()
+                        lines = []
+                        size = 0
+        if lines:
+            write_block()
+    except BaseException:
+        # e.g. a compressed file that is still being written, the day is left as it was
+        archive.close()
+        os.remove(archive_path + '.tmp')
+        raise
+    archive.close()
+
+    records.sort()
+    with open(index_path + '.tmp', 'wb') as index:
+        index.write(HEADER.pack(MAGIC, len(blocks), len(records)))
+        for block in blocks:
+            index.write(BLOCK.pack(*block))
+        for record in records:
+            index.write(RECORD.pack(*record))
+    os.replace(archive_path + '.tmp', archive_path)
+    os.replace(index_path + '.tmp', index_path)
+
+    if remove:
+        for path in sources:
+            if path != archive_path:
+                os.remove(path)
+    logger.info("Compacted " + str(len(sources)) + " files with " + str(len(records)) + " tweets into " +
+                archive_path + ".")
+    return len(records)
+
+
+class _Ids:
+    """ The sorted ids of an index as a sequence for bisect
+    """
+
+    def __init__(self, index, start, count):
+        self.index = index
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return ID.unpack_from(self.index, self.start + i * RECORD.size)[0]
+
+
+class Archive:
+    """ Reads the tweets of an archive written by compact. The index is memory mapped and searched
+    by id, so fetching a tweet reads a few pages of the index and decompresses one block.
+
+        archive = Archive('tweets_folder/2026/10/16/2026-10-16.archive.txt.gz')
+        archive.get(1050118621198921728)
+        for status in archive.range(1050118621198921728, 1050118621198931728):
+            ...
+    """
+
+    def __init__(self, path, index_path=None, cache_size=8):
+        self.path = path
+        self.index_path = index_path or path[:-len(ARCHIVE_EXTENSION)] + INDEX_EXTENSION
+        self.file = open(path, 'rb')
+        with open(self.index_path, 'rb') as f:
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, block_count, self.count = HEADER.unpack_from(self.index)
+        if magic != MAGIC:
+            raise ValueError(self.index_path + " is not an archive index")
+        self.blocks = [BLOCK.unpack_from(self.index, HEADER.size + i * BLOCK.size) for i in range(block_count)]
+        self.start = HEADER.size + block_count * BLOCK.size
+        self.ids = _Ids(self.index, self.start, self.count)
+        self.cache = collections.OrderedDict()  # the last decompressed blocks, number: data
+        self.cache_size = cache_size
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def block(self, number):
+        # the tweets of a range are mostly in consecutive blocks, but tweets of other shards or
+        # search results can be stored a few blocks apart
+        if number in self.cache:
+            self.cache.move_to_end(number)
+            return self.cache[number]
+        offset, length = self.blocks[number]
+        self.file.seek(offset)
+        self.cache[number] = data = zlib.decompress(self.file.read(length), 31)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return data
+
+    def read(self, position):
+        """ Returns the line of the tweet at `position` in the index
+        """
+        _, number, offset = RECORD.unpack_from(self.index, self.start + position * RECORD.size)
+        data = self.block(number)
+        return data[offset:data.index(b'\n', offset)]
+
+    def get(self, status_id, raw=False):
+        """ Returns the tweet with the id, or None if it is not in the archive. With `raw` the line
+        of the tweet is returned as it was written.
+        """
+        position = bisect.bisect_left(self.ids, status_id, 0, self.count)
+        if position == self.count or self.ids[position] != status_id:
+            return None
+        line = self.read(position)
+        return line if raw else loads(line)
+
+    def range(self, lo=0, hi=None, raw=False):
+        """ Yields the tweets with ids from `lo` up to but not including `hi`, ordered by id
+        """
+        position = bisect.bisect_left(self.ids, lo, 0, self.count)
+        end = self.count if hi is None else bisect.bisect_left(self.ids, hi, position, self.count)
+        for position in range(position, end):
+            line = self.read(position)
+            yield line if raw else loads(line)
+
+    def close(self):
+        self.index.close()
+        self.file.close()
@@ -0,0 +1,468 @@
+import csv
+import json
+import logging
+import threading
+import time
+
+import requests
+import six
+from twython import Twython, TwythonStreamer
+from twython.exceptions import TwythonRateLimitError, TwythonError
+
+from . import metrics
+from .passthrough import PassthroughMixin, message_type, tweet_id
+from .pipeline import Pipeline, BLOCK
+from .scheduler import SearchQuery, RateBudget, QueryScheduler, backoff_delay, next_max_id
+from .storage import UNAVAILABLE
+
+if six.PY2:
+    longtype = six.integer_types[1]
+if six.PY3:
+    longtype = six.integer_types[0]
+
+logger = logging.getLogger('twitter')
+
+
+class Connections(object):
+    """ The connections shared by all collectors of a process: one MongoClient
+    per MongoDB deployment and one pool of HTTP connections to the Twitter API.
+    `mongo_options` are passed on to every MongoClient.
+    """
+
+    def __init__(self, pool_size=10, **mongo_options):
+        self.pool_size = pool_size
+        self.mongo_options = mongo_options
+        self.clients = {}
+        self.adapter = None
+        self.lock = threading.Lock()
+
+    def database(self, uri):
+        """ Returns the database named in a MongoDB URI, e.g. mongodb://localhost:27017/twitter
+        """
+        import pymongo
+
+        parsed = pymongo.uri_parser.parse_uri(uri)
+        if not parsed['database']:
+            raise ValueError("The MongoDB URI " + uri + " names no database.")
+        key = (tuple(sorted(parsed['nodelist'])), parsed['username'])
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = pymongo.MongoClient(uri, **self.mongo_options)
+        return self.clients[key][parsed['database']]
+
+    def mount(self, session):
+        """ Makes a requests session use the shared connection pool
+        """
+        with self.lock:
+            if self.adapter is None:
+                self.adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size,
+                                                             pool_maxsize=self.pool_size)
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients = {}
+            if self.adapter:
+                self.adapter.close()
+                self.adapter = None
+
+
+def obtain_access_token(consumer_key, consumer_secret):
+    """ Obtains the application-only access token of the search API
+    """
+    logger.warning("No access token provided in options. Obtaining one now...")
+    access_token = Twython(consumer_key, consumer_secret, oauth_version=2).obtain_access_token()
+    logger.warning("Access token: " + access_token)
+    return access_token
+
+
+def resume_queries(progress, queries):
+    """ Replaces the queries with the ones stored in the `progress` collection, with their
+    since_id and an interrupted pagination chain, which is resumed from its last checkpoint
+    """
+    keys = set((query.geocode, query.lang) for query in queries)
+    stored = {}
+    for geocode, lang in keys:
+        for document in progress.find({'query': {'$in': [query.query for query in queries]},
+                                       'geocode': geocode, 'lang': lang}):
+            stored[(document['query'], geocode, lang)] = document
+    return [SearchQuery.from_document(stored[(query.query, query.geocode, query.lang)])
+            if (query.query, query.geocode, query.lang) in stored else query for query in queries]
+
+
+def load_csv_file(filename):
+    """
+    Accepts a file name and loads it as a list
+    """
+    try:
+        with open(filename + '.csv', 'r') as f:
+            reader = csv.reader(f)
+            temp = list(reader)
+            # flatten to 1D, it gets loaded as 2D array
+            result = [x for sublist in temp for x in sublist]
+    except IOError as e:
+        print("I/O error({0}): {1}".format(e.errno, e.strerror))
+    else:
+        f.closed
+        return result
+
+
+def build_query_string(query_words, api_type):
+    """ 0 for search api, 1 for stream api
+    """
+    if api_type == 0:
+        result = ''.join([q + ' OR ' for q in query_words[0:(len(query_words) - 1)]])
+        return result + str(query_words[len(query_words) - 1])
+    elif api_type == 1:
+        result = ''.join([q + ',' for q in query_words[0:(len(query_words) - 1)]])
+        return result + str(query_words[len(query_words) - 1])
+
+
+def load_query(filename, api_type):
+    """ 0 for search api, 1 for stream api
+    """
+    keywords = load_csv_file(filename)
+    if api_type == 0:
+        return build_query_string(keywords, 0)
+    else:
+        return build_query_string(keywords, 1)
+
+
+class Collector(object):
+    """ Hands the collected tweets through a Pipeline of `writers` threads to a sink
+    """
+
+    def __init__(self, sink, seen=None, projection=None, queue_size=10000, writers=1, queue_policy=BLOCK,
+                 connections=None):
+        self.sink = sink
+        self.seen = seen
+        self.projection = projection
+        self.connections = connections
+        self.stopped = threading.Event()
+        self.thread = None
+        self.threads = []  # the threads run starts besides its own
+        self.pipeline = Pipeline(self.store, maxsize=queue_size, writers=writers, policy=queue_policy)
+
+    def store(self, item):
+        raise NotImplementedError
+
+    def run(self):
+        raise NotImplementedError
+
+    def start(self):
+        """ Runs the collector in a background thread
+        """
+        self.thread = threading.Thread(target=self.run, name=type(self).__name__)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def join(self, timeout=None):
+        """ Waits up to `timeout` seconds for the threads collecting tweets to finish.
+        Returns False if some of them are still running.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        for thread in [self.thread] + self.threads:
+            # close can be called by a signal handler on the thread running the collector
+            if thread is None or thread is threading.current_thread():
+                continue
+            thread.join(None if deadline is None else max(deadline - time.time(), 0))
+            if thread.is_alive():
+                return False
+        return True
+
+    def close(self, timeout=10.0):
+        """ Stops collecting, waits up to `timeout` seconds for the requests in flight to be
+        queued, stores the queued tweets and closes the sink
+        """
+        self.stop()
+        if not self.join(timeout):
+            logger.warning("The collector didn't stop within " + str(timeout) + " seconds, the tweets it is still "
+                           "receiving won't be stored.")
+        self.pipeline.close()
+        self.sink.close()
+
+
+class SearchCollector(Collector):
+    """ Collects the tweets matching a list of queries from the search API.
+
+    The queries are run by `fetchers` threads that share the rate limit
+    `budget`, which can also be shared by several collectors using the same
+    credentials. With a `progress` collection the since_id of every query and,
+    with `checkpoint`, the position in an unfinished pagination chain are
+    stored, so a collector started later continues where this one stopped.
+    """
+
+    def __init__(self, queries, sink, consumer_key, consumer_secret=None, access_token=None, geocode=None, lang=None,
+                 result_type='mixed', progress=None, checkpoint=False, clean=False, wait=0, fetchers=1, budget=None,
+                 rate_limit=450, max_idle=300, **kwargs):
+        if consumer_secret is None and access_token is None:
+            raise ValueError("Consumer secret or access token is required.")
+        Collector.__init__(self, sink, **kwargs)
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.access_token = access_token
+        self.result_type = result_type
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.wait = wait
+        self.fetchers = fetchers
+        self.budget = budget or RateBudget(rate_limit, 15 * 60)
+        self.queries = [query if isinstance(query, SearchQuery) else SearchQuery(query, geocode, lang)
+                        for query in queries]
+        if progress is not None and not clean:
+            self.queries = resume_queries(progress, self.queries)
+        self.scheduler = QueryScheduler(self.queries, max_idle_wait=max_idle)
+
+    def store(self, statuses):
+        ids = [status['id'] for status in statuses]
+        if self.projection:
+            statuses = [self.projection.apply(status) for status in statuses]
+        self.sink.write_many(statuses)
+        if self.seen:
+            # only stored tweets are skipped later, the tweets of a failed page are fetched again
+            for status_id in ids:
+                self.seen.add(status_id)
+
+    def run(self):
+        """ Collects tweets until the collector is stopped
+        """
+        if not self.access_token:
+            self.access_token = obtain_access_token(self.consumer_key, self.consumer_secret)
+        logger.info("Collecting tweets for " + str(len(self.queries)) + " queries from the search API...")
+        for i in range(self.fetchers - 1):
+            fetcher = threading.Thread(target=self.fetch, name='fetcher-' + str(i))
+            fetcher.daemon = True
+            fetcher.start()
+            self.threads.append(fetcher)
+        self.fetch()
+
+    def client(self):
+        twitter = Twython(self.consumer_key, access_token=self.access_token)
+        if self.connections:
+            self.connections.mount(twitter.client)
+        return twitter
+
+    def fetch(self):
+        # every thread gets its own client, the last response headers are kept on it
+        twitter = self.client()
+        while not self.stopped.is_set():
+            search_query = self.scheduler.acquire(timeout=1.0)
+            if search_query is None:
+                continue
+            received = 0
+            try:
+                if search_query.max_id:
+                    logger.debug("Continuing " + repr(search_query) + " at max_id " + str(search_query.max_id))
+                received = self.search_page(twitter, search_query)
+            finally:
+                self.scheduler.release(search_query, received)
+
+    def perform_query(self, twitter, **kwargs):
+        attempt = 0
+        while True:
+            if self.wait:
+                time.sleep(self.wait)
+            self.budget.acquire()
+            try:
+                results = twitter.search(**kwargs)
+            except TwythonRateLimitError as err:
+                logger.warning("Rate limit reached, waiting for the rate limit window to reset...")
+                self.budget.exhausted(err.retry_after)
+                continue
+            except TwythonError as err:
+                delay = backoff_delay(attempt)
+                attempt += 1
+                logger.error("Some other error occured, taking a break for " + str(int(delay)) + " seconds: " + str(err))
+                time.sleep(delay)
+                continue
+            remaining = twitter.get_lastfunction_header(header="x-rate-limit-remaining")
+            self.budget.update(remaining, twitter.get_lastfunction_header(header="x-rate-limit-reset"))
+            if remaining is not None:
+                metrics.RATE_LIMIT_REMAINING.set(int(remaining))
+            return results
+
+    def save_tweets(self, statuses, current_since_id):
+        """ Queues the statuses that were not seen before for storage. Returns the
+        highest id seen so far and the number of new statuses.
+        """
+        metrics.RECEIVED.inc(len(statuses))
+        for status in statuses:
+            current_id = longtype(status['id'])
+            if current_id > current_since_id:
+                current_since_id = current_id
+        if self.seen:
+            statuses = [status for status in statuses if not self.seen.contains(status['id'])]
+        if statuses:
+            self.pipeline.put(statuses)
+
+        if len(statuses) == 0:
+            logger.debug("No new tweets.")
+        else:
+            logger.debug("Received " + str(len(statuses)) + " tweets.")
+        return current_since_id, len(statuses)
+
+    def save_progress(self, search_query, update):
+        try:
+            self.progress.update(search_query.key(), update, upsert=True)
+        except UNAVAILABLE as e:
+            if not getattr(self.sink, 'spool', None):
+                raise
+            # the progress is kept in memory and stored with the next update
+            logger.warning("Couldn't store the progress of " + repr(search_query) + ", MongoDB is unavailable: " + str(e))
+
+    def search_page(self, twitter, search_query):
+        """ Fetches and saves the next page of a query: the newest tweets since its since_id,
+        or the next page of its next_results chain. Returns the number of tweets received.
+        """
+        if not search_query.max_id:
+            # a new chain, every write failing from now on may have been one of its pages
+            search_query.failures = self.pipeline.failures
+        results = self.perform_query(twitter, q=search_query.query, geocode=search_query.geocode,
+                                     lang=search_query.lang, count=100, since_id=search_query.since_id,
+                                     max_id=search_query.max_id, result_type=self.result_type)
+        logger.debug("Rate limit for current window: " + str(
+            twitter.get_lastfunction_header(header="x-rate-limit-remaining")))
+
+        # we compute the new since_id as the maximum of all ids returned in the chain
+        if search_query.next_since_id:
+            current_since_id = longtype(search_query.next_since_id)
+        elif search_query.since_id:
+            current_since_id = longtype(search_query.since_id)
+        else:
+            current_since_id = 0
+        new_since_id, received = self.save_tweets(results['statuses'], current_since_id)
+        search_query.next_since_id = str(new_since_id)
+        search_query.max_id = next_max_id(results)
+
+        if search_query.max_id:
+            if self.checkpoint and self.progress is not None:
+                if not self.stored(search_query):
+                    return received
+                # everything newer than max_id is stored at this point
+                self.save_progress(search_query, {"$set": {'max_id': search_query.max_id,
+                                                           'next_since_id': search_query.next_since_id}})
+        elif self.progress is not None:
+            # only advance since_id once all pages of the chain are stored
+            if not self.stored(search_query):
+                return received
+            search_query.since_id = search_query.next_since_id
+            search_query.next_since_id = None
+            self.save_progress(search_query, {"$set": {'since_id': search_query.since_id},
+                                              "$unset": {'max_id': "", 'next_since_id': ""}})
+        else:
+            search_query.since_id = search_query.next_since_id
+            search_query.next_since_id = None
+        return received
+
+    def stored(self, search_query):
+        """ Waits for the queued pages and tells whether all pages of the chain of a query
+        were stored. Otherwise the chain is started again from the since_id of the query.
+        A failed write of another query also restarts the chain, a page is never lost.
+        """
+        if self.pipeline.join() == search_query.failures:
+            return True
+        logger.error("Not all tweets of " + repr(search_query) + " were stored, fetching them again.")
+        search_query.max_id = None
+        search_query.next_since_id = None
+        return False
+
+
+class TapStreamer(TwythonStreamer):
+    def __init__(self, collector, *args, **kwargs):
+        TwythonStreamer.__init__(self, *args, **kwargs)
+        self.collector = collector
+
+    def on_success(self, data):
+        if 'text' in data:
+            metrics.RECEIVED.inc()
+            self.collector.receive(data, data['id'])
+        if 'limit' in data:
+            metrics.LIMIT_NOTICES.inc()
+            if isinstance(data['limit'], dict) and 'track' in data['limit']:
+                metrics.UNDELIVERED.set(data['limit']['track'])
+            logger.warning(
+                "The filtered stream has matched more Tweets than its current rate limit allows it to be delivered.")
+
+    def on_error(self, status_code, data):
+        logger.error("Received error code " + str(status_code) + ".")
+
+
+class PassthroughTapStreamer(PassthroughMixin, TapStreamer):
+    def on_raw(self, line):
+        kind = message_type(line)
+        if kind == 'tweet':
+            metrics.RECEIVED.inc()
+            self.collector.receive(line, tweet_id(line))
+        elif kind is not None:
+            # control messages are rare and small enough to decode
+            self.on_success(json.loads(line.decode('utf-8')))
+
+
+class StreamCollector(Collector):
+    """ Collects the tweets of a filtered stream matching the `track`, `follow`
+    and `locations` filters, or of the sample or firehose stream. With
+    `passthrough` the tweets are stored exactly as they were received. With a
+    Matcher as `matcher` every tweet is tagged with the track terms it matches
+    in matched_terms.
+    """
+
+    def __init__(self, sink, consumer_key, consumer_secret, access_token, access_token_secret, track=None,
+                 follow=None, locations=None, firehose=False, passthrough=False, matcher=None, **kwargs):
+        Collector.__init__(self, sink, **kwargs)
+        self.track = track
+        self.follow = follow
+        self.locations = locations
+        self.firehose = firehose
+        self.passthrough = passthrough
+        self.matcher = matcher
+        streamer = PassthroughTapStreamer if passthrough else TapStreamer
+        self.streamer = streamer(self, consumer_key, consumer_secret, access_token, access_token_secret)
+        if self.connections:
+            self.connections.mount(self.streamer.client)
+        self.streamer.client.hooks['response'].append(metrics.on_connect)
+
+    def receive(self, tweet, status_id):
+        if not (self.seen and self.seen.check_and_add(status_id)):
+            self.pipeline.put(tweet)
+
+    def store(self, tweet):
+        if self.passthrough:
+            self.sink.write_raw(tweet)
+            return
+        if self.matcher:
+            # the projection may drop the fields the terms are matched in
+            matched_terms = self.matcher.match(tweet)
+        if self.projection:
+            tweet = self.projection.apply(tweet)
+        if self.matcher:
+            tweet['matched_terms'] = matched_terms
+        self.sink.write(tweet)
+
+    def run(self):
+        """ Collects tweets until the collector is stopped
+        """
+        logger.info("Collecting tweets from the streaming API...")
+        if self.follow or self.track or self.locations:
+            # https://github.com/ryanmcgrath/twython/issues/288#issuecomment-66360160
+            while not self.stopped.is_set():
+                try:
+                    self.streamer.statuses.filter(follow=self.follow, track=self.track, locations=self.locations)
+                except requests.exceptions.ChunkedEncodingError as e:
+                    logger.error("The stream was interrupted: " + str(e))
+                    continue
+        elif self.firehose:
+            self.streamer.statuses.firehose()
+        else:
+            self.streamer.statuses.sample()
+
+    def stop(self):
+        Collector.stop(self)
+        self.streamer.disconnect()
@@ -0,0 +1,176 @@
+import collections
+import logging
+import math
+import threading
+
+logger = logging.getLogger('twitter')
+
+MASK64 = (1 << 64) - 1
+
+
+class SeenCache(object):
+    """ A bounded set of recently seen tweet ids.
+
+    check_and_add records an id and tells whether it was seen before, while
+    contains and add do the same in two steps, so that an id can be recorded
+    only once its tweet is stored. The hits and misses counters can be used
+    to size the cache.
+    """
+
+    report_every = 100000
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def check_and_add(self, tweet_id):
+        # a raw tweet whose id can't be found is stored without checking it
+        if tweet_id is None:
+            return False
+        with self.lock:
+            seen = self._check_and_add(int(tweet_id))
+            if seen:
+                self.hits += 1
+            else:
+                self.misses += 1
+            report = (self.hits + self.misses) % self.report_every == 0
+        if report:
+            logger.debug(self.stats())
+        return seen
+
+    def contains(self, tweet_id):
+        """ Tells whether an id was seen before without recording it
+        """
+        with self.lock:
+            seen = self._contains(int(tweet_id))
+            if seen:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return seen
+
+    def add(self, tweet_id):
+        with self.lock:
+            self._add(int(tweet_id))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return ("Seen-ID cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses (" +
+                "%.1f" % rate + "% duplicates), about " + str(self.memory() // 1024) + " KiB.")
+
+    def memory(self):
+        raise NotImplementedError
+
+    def _check_and_add(self, tweet_id):
+        raise NotImplementedError
+
+    def _contains(self, tweet_id):
+        raise NotImplementedError
+
+    def _add(self, tweet_id):
+        raise NotImplementedError
+
+
+class LRUSet(SeenCache):
+    """ Remembers exactly the `capacity` most recently seen ids
+    """
+
+    def __init__(self, capacity=100000):
+        super(LRUSet, self).__init__()
+        self.capacity = capacity
+        self.ids = collections.OrderedDict()
+
+    def memory(self):
+        # an OrderedDict entry with a small int key costs roughly 100 bytes
+        return len(self.ids) * 100
+
+    def _check_and_add(self, tweet_id):
+        if tweet_id in self.ids:
+            self.ids.move_to_end(tweet_id)
+            return True
+        self._add(tweet_id)
+        return False
+
+    def _contains(self, tweet_id):
+        return tweet_id in self.ids
+
+    def _add(self, tweet_id):
+        self.ids[tweet_id] = None
+        self.ids.move_to_end(tweet_id)
+        if len(self.ids) > self.capacity:
+            self.ids.popitem(last=False)
+
+
+class RotatingBloomFilter(SeenCache):
+    """ Two Bloom filters sized for `capacity` ids each. New ids go into the
+    current filter and lookups check both; when the current filter is full the
+    older one is discarded. At least the last `capacity` ids are remembered, a
+    new id is wrongly reported as seen with a probability of about `error_rate`.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        super(RotatingBloomFilter, self).__init__()
+        self.capacity = capacity
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / float(capacity) * math.log(2))))
+        self.current = bytearray((self.bits + 7) // 8)
+        self.previous = bytearray(len(self.current))
+        self.count = 0
+
+    def memory(self):
+        return 2 * len(self.current)
+
+    def _positions(self, tweet_id):
+        # double hashing with two splitmix64 rounds of the id
+        h1 = _mix(tweet_id)
+        h2 = _mix(h1) | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _check_and_add(self, tweet_id):
+        positions = self._positions(tweet_id)
+        if _has(self.current, positions):
+            return True
+        seen = _has(self.previous, positions)
+        self._set(positions)
+        return seen
+
+    def _contains(self, tweet_id):
+        positions = self._positions(tweet_id)
+        return _has(self.current, positions) or _has(self.previous, positions)
+
+    def _add(self, tweet_id):
+        positions = self._positions(tweet_id)
+        if not _has(self.current, positions):
+            self._set(positions)
+
+    def _set(self, positions):
+        current = self.current
+        for p in positions:
+            current[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+        if self.count >= self.capacity:
+            self.previous, self.current = self.current, bytearray(len(self.current))
+            self.count = 0
+
+
+def _has(bits, positions):
+    return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+
+def _mix(x):
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def seen_cache(kind, capacity):
+    """ Builds the seen-ID cache selected on the command line, None for 'none'
+    """
+    if kind == 'lru':
+        return LRUSet(capacity)
+    if kind == 'bloom':
+        return RotatingBloomFilter(capacity)
+    return None
@@ -6,29 +6,129 @@ import os.path
 import time
 import gzip
 import logging
+import threading
+import io
+import weakref
+
+from . import metrics
 
 logger = logging.getLogger('twitter')
 
+# use the fastest JSON encoder available, all of them return UTF-8 encoded bytes
+try:
+    import orjson
+
+    dumps = orjson.dumps
+except ImportError:
+    try:
+        import ujson
+
+        def dumps(obj):
+            return ujson.dumps(obj).encode('utf-8')
+    except ImportError:
+        def dumps(obj):
+            return json.dumps(obj).encode('utf-8')
+
+COMPRESSIONS = {
+    # name: (file extension, default level)
+    'gzip': ('.gz', 6),
+    'zstd': ('.zst', 3),
+}
+
+
 class Filer:
-    def __init__(self, data_dir, n=10000):
+    def __init__(self, data_dir, n=10000, interval=0, compression=None, level=None, serializer=None,
+                 buffer_size=1024 * 1024, flush_bytes=1024 * 1024, flush_interval=1.0, written=None):
         if not os.path.exists(data_dir):
             os.makedirs(data_dir, mode=0o777, exist_ok=True)
+        if compression and compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression: " + str(compression))
         self.data_dir = data_dir
         self.counter = 0  # number of tweets in a file
         self.n = n  # max number of tweets in a file
-        self.flush_every = 100
+        self.interval = interval * 60  # seconds of wall-clock time covered by a file, 0 to rotate by count only
+        self.period = None  # the interval the current file belongs to
+        self.compression = compression
+        self.level = level if level is not None else COMPRESSIONS.get(compression, (None, None))[1]
+        self.dumps = serializer or dumps  # callable turning a tweet into bytes
+        self.buffer_size = buffer_size
+        self.flush_bytes = flush_bytes  # flush once this many bytes were written since the last flush
+        self.flush_interval = flush_interval  # or once this many seconds have passed since the last flush
+        self.unflushed = 0
+        self.unflushed_tweets = 0
+        self.flushed_at = time.time()
+        self.written = written or metrics.WRITTEN  # counts the tweets once they are flushed
         self.file = None
+        self.file_name = None
+        self.compressor = None  # the gzip or zstd writer behind the buffer of a compressed file
+        self.closed = False
+        self.lock = threading.RLock()  # emit may be called from several writer threads
         self.new_file()
+        if flush_interval:
+            # a quiet stream would otherwise keep tweets in the buffer indefinitely, the thread only
+            # holds a weak reference so that it doesn't keep a forgotten filer alive
+            flusher = threading.Thread(target=_flush_stale, args=(weakref.ref(self), flush_interval))
+            flusher.daemon = True
+            flusher.start()
 
     def emit(self, dict_entry):
-        text_to_wtite = json.dumps(dict_entry) + "\n"
-        self.file.write(text_to_wtite)
-        self.counter += 1
-        if self.counter % self.flush_every == 0:
-            self.file.flush()
-        if self.counter >= self.n:  # add condition  "if new day"
-            self.close_file()
-            self.new_file()
+        self.write(self.dumps(dict_entry) + b"\n")
+
+    def emit_raw(self, line):
+        """ Writes an already serialized tweet, as received from the stream
+        """
+        self.write(line + b"\n")
+
+    def write(self, entry):
+        with self.lock:
+            # rotate first, so the first tweet of an hour or a day isn't written to the file of the last one
+            if self.rotation_due():
+                self.close_file()
+                self.new_file()
+            self.append(entry)
+            self.counter += 1
+
+    def append(self, bytes_to_write):
+        """ Adds a tweet to the current file, called by write with the lock held
+        """
+        self.file.write(bytes_to_write)
+        self.unflushed += len(bytes_to_write)
+        self.unflushed_tweets += 1
+        if self.unflushed >= self.flush_bytes or time.time() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            with metrics.WRITE_SECONDS.time():
+                self.file.flush()
+                # the buffer only hands the data to the compressor, which keeps it until it is flushed too
+                if self.compression == 'gzip':
+                    self.compressor.flush()
+                elif self.compression == 'zstd':
+                    import zstandard
+                    self.compressor.flush(zstandard.FLUSH_BLOCK)
+            self.written.inc(self.unflushed_tweets)
+            self.unflushed = 0
+            self.unflushed_tweets = 0
+            self.flushed_at = time.time()
+
+    def flush_stale(self):
+        """ Flushes the tweets written more than flush_interval seconds ago. Returns False once the
+        file is closed for good.
+        """
+        with self.lock:
+            if self.closed:
+                return False
+            if self.unflushed and time.time() - self.flushed_at >= self.flush_interval:
+                self.flush()
+            return True
+
+    def rotation_due(self):
+        return self.counter >= self.n or (self.interval and self.current_period() != self.period)
+
+    def current_period(self):
+        # intervals are aligned to the epoch, so an hour or a day starts on the hour or at midnight UTC
+        return int(time.time() // self.interval)
 
     def new_file(self):
         # generate directory name & create it if id does not exist, time in UTC!
@@ -37,21 +137,57 @@ class Filer:
         os.makedirs(directory, mode=0o777, exist_ok=True)  # don't raise an error if the directory already exists
 
         # generate filename
-        file_name = os.path.join(directory, now.strftime("%Y-%m-%d_%H-%M-%S") + ".txt")
+        extension = self.extension()
+        file_name = os.path.join(directory, now.strftime("%Y-%m-%d_%H-%M-%S") + extension)
         while os.path.exists(file_name):
-            file_name = os.path.join(directory, now.strftime("%Y-%m-%d_%H-%M-%S-%f") + ".txt")
+            file_name = os.path.join(directory, now.strftime("%Y-%m-%d_%H-%M-%S-%f") + extension)
 
         logger.debug("Creating new file: " + file_name)
 
         # open file
-        self.file = open(file_name, 'w')
+        self.file_name = file_name
+        self.file = self.open_file(file_name)
+        self.closed = False
+        if self.interval:
+            self.period = self.current_period()
+
+    def extension(self):
+        if self.compression:
+            return ".txt" + COMPRESSIONS[self.compression][0]
+        return ".txt"
+
+    def open_file(self, file_name):
+        # the large buffer in front of the compressors batches many small tweets into one compress call
+        if self.compression == 'gzip':
+            self.compressor = gzip.open(file_name, 'wb', compresslevel=self.level)
+            return io.BufferedWriter(self.compressor, self.buffer_size)
+        if self.compression == 'zstd':
+            import zstandard
+            self.compressor = zstandard.ZstdCompressor(level=self.level).stream_writer(open(file_name, 'wb'))
+            return io.BufferedWriter(self.compressor, self.buffer_size)
+        return open(file_name, 'wb', buffering=self.buffer_size)
 
     def close_file(self):
-        try:
-            self.file.close()
-        except AttributeError:
-            pass
-        self.counter = 0
+        with self.lock:
+            try:
+                self.file.close()
+            except AttributeError:
+                pass
+            if self.unflushed_tweets:
+                self.written.inc(self.unflushed_tweets)
+            self.counter = 0
+            self.unflushed = 0
+            self.unflushed_tweets = 0
+            self.closed = True
 
     def __del__(self):
         self.close_file()
+
+
+def _flush_stale(reference, interval):
+    while True:
+        time.sleep(interval)
+        filer = reference()
+        if filer is None or not filer.flush_stale():
+            return
+        del filer
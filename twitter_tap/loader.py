@@ -0,0 +1,154 @@
+import functools
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import os
+import signal
+
+from .filer import COMPRESSIONS
+from .storage import bulk_upsert
+from .transform import convert_dates
+
+logger = logging.getLogger('twitter')
+
+# use the fastest JSON decoder available
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+
+        loads = ujson.loads
+    except ImportError:
+        def loads(line):
+            return json.loads(line.decode('utf-8'))
+
+EXTENSIONS = ['.txt'] + ['.txt' + extension for extension, _ in COMPRESSIONS.values()]
+
+
+def find_files(directory):
+    """ Returns the paths of all files written by Filer below `directory`, oldest first
+    """
+    paths = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(names)
+                     if any(name.endswith(extension) for extension in EXTENSIONS))
+    return paths
+
+
+def open_file(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')))
+    return open(path, 'rb')
+
+
+def parse_file(path, projection=None):
+    """ Reads a file in a worker process and returns (path, statuses, error), where
+    the statuses are ready for MongoDB and error is None if the whole file was read.
+    """
+    statuses = []
+    try:
+        with open_file(path) as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    status = loads(line)
+                except ValueError:
+                    logger.warning("Skipped the invalid line " + str(number) + " of " + path + ".")
+                    continue
+                if projection:
+                    status = projection.apply(status)
+                statuses.append(convert_dates(status))
+    except Exception as e:
+        # e.g. a compressed file that is still being written
+        return path, statuses, str(e)
+    return path, statuses, None
+
+
+def _init_worker(log_format, log_level):
+    logging.basicConfig(format=log_format, level=log_level)
+    # the parent process stops the workers when it shuts down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Loader:
+    """ Imports the files of a Filer output directory into a tweets collection.
+
+    Files are parsed by a pool of worker processes and written with large
+    unordered bulk upserts. Every file that was stored completely is recorded
+    in the `files` collection by its path, size and modification time, so an
+    interrupted import resumes with the files that are new or have changed.
+    """
+
+    def __init__(self, tweets, files, processes=None, batch_size=5000, projection=None, log_format=None,
+                 log_level=None):
+        self.tweets = tweets
+        self.files = files
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.projection = projection
+        self.log_format = log_format
+        self.log_level = log_level
+        self.batch = []
+        self.done = []  # checkpoints of the files whose tweets are all in the batch
+        self.loaded = 0
+
+    def pending(self, directory, reload=False):
+        """ Returns the files below `directory` that were not loaded yet with their checkpoints
+        """
+        checkpoints = {} if reload else dict((document['path'], document) for document in self.files.find())
+        pending = []
+        for path in find_files(directory):
+            stat = os.stat(path)
+            checkpoint = {'path': os.path.relpath(path, directory), 'size': stat.st_size, 'mtime': stat.st_mtime}
+            loaded = checkpoints.get(checkpoint['path'])
+            if not loaded or loaded['size'] != checkpoint['size'] or loaded['mtime'] != checkpoint['mtime']:
+                pending.append((path, checkpoint))
+        return pending
+
+    def load(self, directory, reload=False):
+        """ Loads all new and changed files below `directory`. Returns the number of stored tweets.
+        """
+        pending = self.pending(directory, reload)
+        logger.info("Loading " + str(len(pending)) + " files from " + directory + " with " +
+                    str(self.processes) + " processes.")
+        checkpoints = dict(pending)
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(self.processes, initializer=_init_worker, initargs=(self.log_format, self.log_level)) as pool:
+            parse = functools.partial(parse_file, projection=self.projection)
+            results = pool.imap_unordered(parse, [path for path, _ in pending])
+            for number, (path, statuses, error) in enumerate(results, 1):
+                self.batch.extend(statuses)
+                if error:
+                    logger.error("Couldn't read all of " + path + ", it will be loaded again next time: " + error)
+                else:
+                    self.done.append(checkpoints[path])
+                if len(self.batch) >= self.batch_size:
+                    self.flush()
+                if number % 100 == 0:
+                    logger.info("Loaded " + str(number) + " of " + str(len(pending)) + " files.")
+        self.flush()
+        return self.loaded
+
+    def flush(self):
+        if not self.batch and not self.done:
+            return
+        for start in range(0, len(self.batch), self.batch_size):
+            bulk_upsert(self.tweets, self.batch[start:start + self.batch_size])
+        self.loaded += len(self.batch)
+        for checkpoint in self.done:
+            self.files.replace_one({'path': checkpoint['path']}, checkpoint, upsert=True)
+        logger.debug("Stored " + str(len(self.batch)) + " tweets from " + str(len(self.done)) + " files.")
+        self.batch = []
+        self.done = []
+
@@ -0,0 +1,136 @@
+import collections
+import re
+
+# use the C implementation of the automaton when it is installed
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class Automaton:
+    """ An Aho-Corasick automaton finding all occurrences of a set of words in
+    a single pass over a text
+    """
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for word in words:
+            state = 0
+            for char in word:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(word)
+        # breadth first, the fail link of a state points to a state closer to the root
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, target in self.goto[state].items():
+                queue.append(target)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[target] = self.goto[fallback].get(char, 0) if state else 0
+                self.output[target] = self.output[target] + self.output[self.fail[target]]
+
+    def iter(self, text):
+        """ Yields (end index, word) for every occurrence of a word in the text
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for word in output[state]:
+                yield index, word
+
+
+def _automaton(words):
+    if ahocorasick is None:
+        return Automaton(words)
+    automaton = ahocorasick.Automaton()
+    for word in words:
+        automaton.add_word(word, word)
+    automaton.make_automaton()
+    return automaton
+
+
+def haystack(status):
+    """ Returns the text a tweet is matched against: its text, the hashtags,
+    mentioned users and links of its entities and the same of the tweets it
+    retweets or quotes
+    """
+    parts = []
+    for tweet in (status, status.get('retweeted_status'), status.get('quoted_status')):
+        if not isinstance(tweet, dict):
+            continue
+        extended = tweet.get('extended_tweet') or {}
+        parts.append(extended.get('full_text') or tweet.get('full_text') or tweet.get('text') or '')
+        for entities in (tweet.get('entities'), extended.get('entities')):
+            if not isinstance(entities, dict):
+                continue
+            parts.extend('#' + hashtag.get('text', '') for hashtag in entities.get('hashtags') or [])
+            parts.extend('@' + mention.get('screen_name', '') for mention in entities.get('user_mentions') or [])
+            for url in entities.get('urls') or []:
+                parts.append(url.get('expanded_url') or '')
+                parts.append(url.get('display_url') or '')
+        user = tweet.get('user')
+        if isinstance(user, dict) and user.get('screen_name'):
+            parts.append('@' + user['screen_name'])
+    return '\n'.join(parts).lower()
+
+
+class Matcher:
+    """ Finds the track terms a tweet matches, the way the filter stream
+    matches them: a term of several words matches when all of its words occur,
+    in any order, and a word matches case insensitively when it is not part of
+    a longer word, so "twitter" matches "#Twitter", "@twitter" and
+    "twitter.com". The words of all terms are found in a single pass over the
+    text and entities of the tweet.
+    """
+
+    def __init__(self, terms):
+        self.terms = []
+        self.words = {}  # term: its words
+        self.by_word = collections.defaultdict(list)  # word: the terms containing it
+        for term in terms:
+            term = term.strip()
+            if not term or term in self.words:
+                continue
+            self.terms.append(term)
+            self.words[term] = set(term.lower().split())
+            for word in self.words[term]:
+                self.by_word[word].append(term)
+        self.automaton = _automaton(list(self.by_word))
+
+    def find(self, text):
+        """ Returns the words of the terms occurring in the text as whole words
+        """
+        found = set()
+        for end, word in self.automaton.iter(text):
+            if word in found:
+                continue
+            start = end - len(word) + 1
+            if (start == 0 or not text[start - 1].isalnum()) and (end + 1 == len(text) or not text[end + 1].isalnum()):
+                found.add(word)
+        return found
+
+    def match(self, status):
+        """ Returns the terms a tweet matches, in the order they were given
+        """
+        found = self.find(haystack(status))
+        candidates = set(term for word in found for term in self.by_word[word])
+        return [term for term in self.terms if term in candidates and self.words[term] <= found]
+
+
+def topic(term):
+    """ Turns a term into a name usable for a collection or a directory
+    """
+    return re.sub(r'\W+', '_', term.lower()).strip('_') or 'term'
@@ -0,0 +1,227 @@
+import bisect
+import logging
+import threading
+import time
+
+from six.moves import BaseHTTPServer
+
+logger = logging.getLogger('twitter')
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+
+    def samples(self):
+        """ Returns the (name, value) pairs of the metric in the Prometheus text format
+        """
+        raise NotImplementedError
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " " + self.kind]
+        lines.extend(name + " " + _format(value) for name, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        super(Counter, self).__init__(name, help)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.value)]
+
+
+class Gauge(Metric):
+    """ A value that is set, or read from a function whenever it is collected
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help):
+        super(Gauge, self).__init__(name, help)
+        self._value = None
+        self.function = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    @property
+    def value(self):
+        return self.function() if self.function else self._value
+
+    def samples(self):
+        value = self.value
+        return [] if value is None else [(self.name, value)]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        super(Histogram, self).__init__(name, help)
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self):
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        samples = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + [float('inf')], counts):
+            cumulative += bucket
+            samples.append((self.name + '_bucket{le="' + _format(bound) + '"}', cumulative))
+        samples.append((self.name + '_sum', total))
+        samples.append((self.name + '_count', count))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.time()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.time() - self.started)
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+RECEIVED = REGISTRY.register(Counter('tap_tweets_received_total', 'Tweets received from Twitter.'))
+WRITTEN = REGISTRY.register(Counter('tap_tweets_written_total', 'Tweets written to MongoDB or the output files.'))
+DROPPED = REGISTRY.register(Counter('tap_tweets_dropped_total', 'Tweets dropped because the storage queue was full.'))
+WRITE_ERRORS = REGISTRY.register(Counter('tap_write_errors_total', 'Failed writes to the storage.'))
+WRITE_SECONDS = REGISTRY.register(Histogram(
+    'tap_write_seconds', 'Duration of the bulk writes to MongoDB and the flushes of the output files.',
+    [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]))
+QUEUE_DEPTH = REGISTRY.register(Gauge('tap_queue_depth', 'Items waiting in the storage queue.'))
+BUFFER_DEPTH = REGISTRY.register(Gauge('tap_buffer_depth', 'Tweets waiting in the MongoDB batch buffer.'))
+LIMIT_NOTICES = REGISTRY.register(Counter('tap_limit_notices_total', 'Limit notices received from the stream.'))
+UNDELIVERED = REGISTRY.register(Gauge(
+    'tap_limit_undelivered', 'Matching tweets not delivered since the stream connected, as reported by the last limit notice.'))
+CONNECTIONS = REGISTRY.register(Counter('tap_stream_connections_total', 'Connections made to the streaming API.'))
+RECONNECTS = REGISTRY.register(Counter('tap_stream_reconnects_total', 'Connections made to the streaming API after the first one.'))
+SPOOLED = REGISTRY.register(Counter('tap_tweets_spooled_total', 'Tweets written to the disk spool while MongoDB was unavailable.'))
+RATE_LIMIT_REMAINING = REGISTRY.register(Gauge(
+    'tap_rate_limit_remaining', 'Search requests left in the current rate limit window, from the x-rate-limit-remaining header.'))
+
+
+def on_connect(response, *args, **kwargs):
+    """ A requests response hook counting the connections of a streamer
+    """
+    CONNECTIONS.inc()
+    if CONNECTIONS.value > 1:
+        RECONNECTS.inc()
+
+
+def serve(port, address='127.0.0.1', registry=REGISTRY):
+    """ Serves the metrics in the Prometheus text format at http://address:port/metrics from a daemon thread
+    """
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request from " + self.address_string() + ": " + format % args)
+
+    server = BaseHTTPServer.HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class Reporter:
+    """ Logs a summary of the metrics every `interval` seconds from a daemon thread
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.thread = threading.Thread(target=self._run, name='metrics-reporter')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def summary(self, previous, elapsed):
+        received, written, count, total = RECEIVED.value, WRITTEN.value, WRITE_SECONDS.count, WRITE_SECONDS.sum
+        writes = count - previous[2]
+        latency = 1000.0 * (total - previous[3]) / writes if writes else 0.0
+        line = ("Received " + str(received) + " tweets (" + "%.1f" % ((received - previous[0]) / elapsed) + "/s), wrote " +
+                str(written) + " (" + "%.1f" % ((written - previous[1]) / elapsed) + "/s), dropped " +
+                str(DROPPED.value) + ", " + str(WRITE_ERRORS.value) + " write errors, " + "%.1f" % latency +
+                " ms per write, queue depth " + str(QUEUE_DEPTH.value or 0) + ".")
+        if SPOOLED.value:
+            line += " Spooled " + str(SPOOLED.value) + " tweets."
+        if BUFFER_DEPTH.value is not None:
+            line += " Buffer depth " + str(BUFFER_DEPTH.value) + "."
+        if CONNECTIONS.value:
+            line += (" " + str(LIMIT_NOTICES.value) + " limit notices (" + str(UNDELIVERED.value or 0) +
+                     " undelivered), " + str(RECONNECTS.value) + " reconnects.")
+        if RATE_LIMIT_REMAINING.value is not None:
+            line += " Rate limit remaining " + str(RATE_LIMIT_REMAINING.value) + "."
+        return line, (received, written, count, total)
+
+    def _run(self):
+        previous = (0, 0, 0, 0.0)
+        reported_at = time.time()
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            line, previous = self.summary(previous, now - reported_at)
+            reported_at = now
+            logger.info(line)
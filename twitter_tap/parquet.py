@@ -0,0 +1,160 @@
+import datetime
+import logging
+
+import pyarrow
+import pyarrow.parquet
+
+from . import metrics
+from .filer import Filer, dumps
+from .transform import parse_datetime
+
+logger = logging.getLogger('twitter')
+
+TYPES = {
+    'int64': pyarrow.int64(),
+    'float64': pyarrow.float64(),
+    'bool': pyarrow.bool_(),
+    'string': pyarrow.string(),
+    'timestamp': pyarrow.timestamp('s', tz='UTC'),
+    'list<float64>': pyarrow.list_(pyarrow.float64()),
+    'list<string>': pyarrow.list_(pyarrow.string()),
+    'json': pyarrow.string(),  # any value, stored as its JSON text
+}
+
+# (field path, type, column name)
+DEFAULT_SCHEMA = [
+    ('id', 'int64', 'id'),
+    ('created_at', 'timestamp', 'created_at'),
+    ('user.id', 'int64', 'user_id'),
+    ('text', 'string', 'text'),
+    ('lang', 'string', 'lang'),
+    ('coordinates.coordinates', 'list<float64>', 'coordinates'),
+]
+
+# parquet compresses every column chunk itself, the snappy codec when --compression is not given
+CODECS = {
+    None: 'snappy',
+    'gzip': 'gzip',
+    'zstd': 'zstd',
+}
+
+
+def load_schema(filename):
+    """ Loads the columns of the parquet files from a file with one field per
+    line: the dotted field path, optionally followed by the type and the column
+    name, e.g. "user.followers_count int64 followers". Fields without a type are
+    stored as JSON text, the column name defaults to the path with underscores.
+    Lines starting with "#" are comments.
+    """
+    schema = []
+    with open(filename, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if not parts or parts[0].startswith('#'):
+                continue
+            path = parts[0]
+            type_name = parts[1] if len(parts) > 1 else 'json'
+            column = parts[2] if len(parts) > 2 else path.replace('.', '_')
+            if type_name not in TYPES:
+                raise ValueError("Unknown type " + type_name + " of the field " + path + ", use one of " +
+                                 ", ".join(sorted(TYPES)) + ".")
+            schema.append((path, type_name, column))
+    if not schema:
+        raise ValueError("The schema in " + filename + " has no fields.")
+    return schema
+
+
+def _timestamp(value):
+    return value if isinstance(value, datetime.datetime) else parse_datetime(value)
+
+
+def _string(value):
+    return value if isinstance(value, str) else dumps(value).decode('utf-8')
+
+
+CONVERTERS = {
+    'int64': int,
+    'float64': float,
+    'bool': bool,
+    'string': _string,
+    'timestamp': _timestamp,
+    'list<float64>': lambda value: [float(item) for item in value],
+    'list<string>': lambda value: [_string(item) for item in value],
+    'json': lambda value: dumps(value).decode('utf-8'),
+}
+
+
+class ParquetFiler(Filer):
+    """ Writes the tweets to parquet files instead of JSON lines, with one
+    column per field of the `schema`, so that a scan reads only the columns it
+    needs. Tweets are buffered and written as a row group of `row_group_size`
+    rows. Files are rotated like the JSON files, after `n` tweets or when the
+    `interval` is over, and are only readable once they are closed.
+    """
+
+    def __init__(self, data_dir, n=10000, interval=0, compression=None, level=None, schema=None,
+                 row_group_size=10000):
+        self.schema = schema or DEFAULT_SCHEMA
+        self.fields = [(path.split('.'), CONVERTERS[type_name]) for path, type_name, column in self.schema]
+        self.arrow_schema = pyarrow.schema([(column, TYPES[type_name]) for path, type_name, column in self.schema])
+        self.row_group_size = row_group_size
+        self.columns = [[] for field in self.fields]
+        # the buffered rows are only readable once the file is closed, flushing them on a timer doesn't help
+        Filer.__init__(self, data_dir, n, interval, compression, level, flush_interval=0)
+
+    def emit(self, dict_entry):
+        self.write(dict_entry)
+
+    def append(self, dict_entry):
+        for (keys, convert), column in zip(self.fields, self.columns):
+            column.append(_extract(dict_entry, keys, convert))
+        self.unflushed_tweets += 1
+        if self.unflushed_tweets >= self.row_group_size:
+            self.flush()
+
+    def emit_raw(self, line):
+        raise NotImplementedError("parquet files are written column by column, raw tweets can not be stored")
+
+    def flush(self):
+        """ Writes the buffered tweets as a row group
+        """
+        with self.lock:
+            if not self.unflushed_tweets:
+                return
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(self.columns, self.arrow_schema)],
+                schema=self.arrow_schema)
+            with metrics.WRITE_SECONDS.time():
+                self.file.write_table(table)
+            self.written.inc(self.unflushed_tweets)
+            self.columns = [[] for field in self.fields]
+            self.unflushed_tweets = 0
+
+    def extension(self):
+        return ".parquet"
+
+    def open_file(self, file_name):
+        return pyarrow.parquet.ParquetWriter(file_name, self.arrow_schema, compression=CODECS[self.compression],
+                                             compression_level=self.level)
+
+    def close_file(self):
+        with self.lock:
+            if self.file is not None and self.unflushed_tweets:
+                self.flush()
+            Filer.close_file(self)
+
+
+def _extract(status, keys, convert):
+    """ Returns the converted value at the path `keys` of a tweet, None if it is missing or can't be converted
+    """
+    value = status
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    if value is None:
+        return None
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        return None
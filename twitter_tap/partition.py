@@ -0,0 +1,179 @@
+import collections
+import datetime
+import logging
+import re
+import threading
+
+logger = logging.getLogger('twitter')
+
+PERIODS = {
+    # name: (collection name suffix, pattern of the suffix)
+    'day': ('%Y_%m_%d', r'\d{4}_\d{2}_\d{2}'),
+    'week': ('%G_W%V', r'\d{4}_W\d{2}'),
+    'month': ('%Y_%m', r'\d{4}_\d{2}'),
+    'year': ('%Y', r'\d{4}'),
+}
+
+DEFAULT_INDEXES = ['id', 'coordinates.coordinates']
+
+
+def index_spec(field):
+    """ Returns the keys and options of the index on a field: the tweet id is
+    unique, coordinates get a 2d index and everything else an ascending one
+    """
+    import pymongo
+
+    if field == 'id':
+        return [('id', pymongo.DESCENDING)], {'unique': True}
+    if field == 'coordinates.coordinates':
+        return [(field, pymongo.GEO2D)], {}
+    return [(field, pymongo.ASCENDING)], {}
+
+
+def create_indexes(collection, indexes, ttl=0):
+    """ Builds the indexes on the given fields, and with a `ttl` in seconds a
+    TTL index that removes tweets once their created_at is that old
+    """
+    for field in indexes:
+        keys, options = index_spec(field)
+        collection.create_index(keys, **options)
+    if ttl:
+        import pymongo
+
+        collection.create_index([('created_at', pymongo.ASCENDING)], expireAfterSeconds=ttl)
+
+
+def index_names(indexes, ttl=0):
+    """ Returns the names MongoDB gives the indexes built by create_indexes
+    """
+    import pymongo
+
+    keys = [index_spec(field)[0] for field in indexes]
+    if ttl:
+        keys.append([('created_at', pymongo.ASCENDING)])
+    return ['_'.join(field + '_' + str(direction) for field, direction in index) for index in keys]
+
+
+def remove_duplicates(collection):
+    """ Keeps one document per tweet id, so that a unique index can be built
+    """
+    duplicates = collection.aggregate([
+        {'$group': {'_id': '$id', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ], allowDiskUse=True)
+    removed = 0
+    for duplicate in duplicates:
+        removed += collection.delete_many({'_id': {'$in': duplicate['ids'][1:]}}).deleted_count
+    if removed:
+        logger.info("Removed " + str(removed) + " duplicate tweets from " + collection.name + ".")
+
+
+class Partitioner:
+    """ Spreads the tweets over one collection per period, named after the
+    created_at of the tweets, e.g. tweets_2026_10 for monthly partitions.
+
+    The indexes of a collection are built when its first tweet arrives, or
+    with `defer_indexes` only once the period is over and the collection is
+    sealed, which keeps the inserts into the current collection cheap. With
+    a `retention` only that many of the most recent collections are kept.
+    """
+
+    def __init__(self, db, prefix='tweets', period='month', indexes=None, defer_indexes=False, retention=0, ttl=0):
+        if period not in PERIODS:
+            raise ValueError("Unknown partition period: " + str(period))
+        self.db = db
+        self.prefix = prefix
+        self.format, pattern = PERIODS[period]
+        self.pattern = re.compile('^' + re.escape(prefix) + '_' + pattern + '$')
+        self.indexes = DEFAULT_INDEXES if indexes is None else indexes
+        self.defer_indexes = defer_indexes
+        self.retention = retention  # number of collections to keep, 0 keeps all
+        self.ttl = ttl
+        self.prepared = set()  # collections that have their indexes, or get them when sealed
+        self.sealed = set()
+        self.current = self.name(datetime.datetime.utcnow())
+        self.lock = threading.Lock()
+        self.maintenance = threading.Lock()
+
+    def name(self, created_at):
+        return self.prefix + '_' + created_at.strftime(self.format)
+
+    def collection(self, name):
+        if name not in self.prepared:
+            with self.lock:
+                if name not in self.prepared:
+                    if not self.defer_indexes:
+                        create_indexes(self.db[name], self.indexes, self.ttl)
+                    self.prepared.add(name)
+        return self.db[name]
+
+    def route(self, statuses):
+        """ Returns (collection, statuses) pairs that split the statuses by their created_at
+        """
+        self.check_rollover()
+        groups = collections.OrderedDict()
+        for status in statuses:
+            created_at = status.get('created_at')
+            if not isinstance(created_at, datetime.datetime):
+                created_at = datetime.datetime.utcnow()
+            groups.setdefault(self.name(created_at), []).append(status)
+        return [(self.collection(name), group) for name, group in groups.items()]
+
+    def check_rollover(self):
+        current = self.name(datetime.datetime.utcnow())
+        if current != self.current:
+            self.current = current
+            logger.info("Rolling over to the collection " + current + ".")
+            self.start()
+
+    def partitions(self):
+        # list_collection_names needs PyMongo 3.7
+        names = self.db.collection_names(include_system_collections=False)
+        return sorted(name for name in names if self.pattern.match(name))
+
+    def start(self):
+        """ Seals and expires the collections of past periods in a background thread
+        """
+        thread = threading.Thread(target=self.maintain, name='partition-maintenance')
+        thread.daemon = True
+        thread.start()
+
+    def maintain(self):
+        with self.maintenance:
+            self._maintain()
+
+    def _maintain(self):
+        partitions = self.partitions()
+        if self.retention:
+            # the current collection may not exist yet, but it is always kept
+            keep = sorted(set(partitions) | {self.current})[-self.retention:]
+            for name in partitions:
+                if name not in keep:
+                    logger.warning("Dropping the collection " + name + ", it is past the retention of " +
+                                   str(self.retention) + " collections.")
+                    self.db.drop_collection(name)
+                    self.prepared.discard(name)
+            partitions = [name for name in partitions if name in keep]
+        for name in partitions:
+            if name < self.current and name not in self.sealed:
+                self.seal(name)
+
+    def seal(self, name):
+        """ Builds the deferred indexes of a collection whose period is over
+        """
+        # a collection sealed before the last start already has its indexes
+        if self.defer_indexes and not set(index_names(self.indexes, self.ttl)) <= set(self.db[name].index_information()):
+            logger.info("Sealing the collection " + name + ", building its indexes...")
+            if 'id' in self.indexes:
+                remove_duplicates(self.db[name])
+            create_indexes(self.db[name], self.indexes, self.ttl)
+        self.sealed.add(name)
+
+
+def routes(target, statuses):
+    """ Splits statuses by the collection they are stored in, `target` is a
+    collection or a Partitioner
+    """
+    if isinstance(target, Partitioner):
+        return target.route(statuses)
+    return [(target, statuses)]
@@ -0,0 +1,71 @@
+import re
+
+import requests
+
+# the first "id" of a tweet is its own, the nested objects come after it
+TWEET_ID = re.compile(br'"id":(\d+)')
+
+# top level keys of the stream messages that are not tweets
+# https://developer.twitter.com/en/docs/tweets/filter-realtime/guides/streaming-message-types
+CONTROL_MESSAGES = [
+    b'delete', b'scrub_geo', b'limit', b'status_withheld', b'user_withheld', b'disconnect', b'warning',
+    b'friends', b'friends_str', b'event', b'for_user', b'control',
+]
+
+
+def message_type(line):
+    """ Classifies a raw stream line without decoding it. Control messages are
+    recognised by their first key, tweets by a "text" key. Returns 'tweet', the
+    name of the control message or None for anything else.
+    """
+    if line.startswith(b'{"'):
+        key = line[2:line.find(b'"', 2)]
+        if key in CONTROL_MESSAGES:
+            return key.decode('ascii')
+    if b'"text":' in line:
+        return 'tweet'
+    return None
+
+
+def tweet_id(line):
+    """ Extracts the id of a raw tweet without decoding it, None if there is none
+    """
+    match = TWEET_ID.search(line)
+    return int(match.group(1)) if match else None
+
+
+class PassthroughMixin(object):
+    """ Replaces the reading loop of TwythonStreamer so that on_raw receives
+    the undecoded bytes of every line instead of on_success receiving the
+    parsed message.
+    """
+
+    def on_raw(self, line):
+        pass
+
+    def _request(self, url, method='GET', params=None):
+        from twython.helpers import _transparent_params
+
+        self.connected = True
+        method = method.lower()
+        params, _ = _transparent_params(params or {})
+        requests_args = dict((k, v) for k, v in self.client_args.items() if k in ('timeout', 'allow_redirects', 'verify'))
+        if method == 'get':
+            requests_args['params'] = params
+        else:
+            requests_args['data'] = params
+
+        while self.connected:
+            try:
+                response = getattr(self.client, method)(url, **requests_args)
+            except requests.exceptions.Timeout:
+                self.on_timeout()
+                continue
+            if response.status_code != 200:
+                self.on_error(response.status_code, response.content)
+            for line in response.iter_lines(self.chunk_size):
+                if not self.connected:
+                    break
+                if line:
+                    self.on_raw(line)
+            response.close()
@@ -0,0 +1,115 @@
+import logging
+import threading
+
+import six
+
+from . import metrics
+
+if six.PY2:
+    import Queue as queue
+if six.PY3:
+    import queue
+
+logger = logging.getLogger('twitter')
+
+BLOCK = 'block'
+DROP_NEWEST = 'drop-newest'
+DROP_OLDEST = 'drop-oldest'
+POLICIES = [BLOCK, DROP_NEWEST, DROP_OLDEST]
+
+_STOP = object()
+
+
+class Pipeline:
+    """ Hands items from the thread reading the Twitter API to a pool of
+    writer threads through a bounded queue.
+
+    When the queue is full the `block` policy makes the reader wait for the
+    writers (backpressure), `drop-newest` discards the incoming item and
+    `drop-oldest` discards the oldest queued item to make room for it.
+    With zero writers the handler is called inline on the reader thread.
+    """
+
+    def __init__(self, handler, maxsize=10000, writers=1, policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy: " + str(policy))
+        self.handler = handler
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.failures = 0  # items whose handler raised an error
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(writers):
+            thread = threading.Thread(target=self._work, name='writer-' + str(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, item):
+        if not self.threads:
+            self._handle(item)
+            return
+        if self.policy == BLOCK:
+            self.queue.put(item)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                if self.policy == DROP_NEWEST:
+                    self._drop(item)
+                    return
+            try:
+                oldest = self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            self.queue.task_done()
+            self._drop(oldest)
+
+    def join(self):
+        """ Blocks until every item put so far has been handled. Returns the number of items
+        that failed since the pipeline was started, so a caller can compare it with an
+        earlier count to find out whether its items were stored.
+        """
+        self.queue.join()
+        return self.failures
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def close(self, timeout=None):
+        """ Drains the queue and stops the writer threads
+        """
+        for thread in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def _drop(self, item):
+        # a search result page is a list of tweets
+        metrics.DROPPED.inc(len(item) if isinstance(item, list) else 1)
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logger.warning("The storage queue is full, " + str(self.dropped) + " items dropped so far.")
+
+    def _handle(self, item):
+        try:
+            self.handler(item)
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+            metrics.WRITE_ERRORS.inc()
+            logger.error("Couldn't save: " + str(e))
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._handle(item)
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,183 @@
+import collections
+import logging
+import random
+import threading
+import time
+
+from six.moves.urllib.parse import urlparse, parse_qsl
+
+logger = logging.getLogger('twitter')
+
+
+def backoff_delay(attempt, base=2.0, cap=300.0):
+    """ Exponential backoff with jitter: a random delay between half and all of
+    base * 2 ** attempt seconds, capped at `cap` seconds.
+    """
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def next_max_id(results):
+    """ Returns the max_id of the next page of search results, None after the last page
+    """
+    next_results = results['search_metadata'].get('next_results')
+    if not next_results:
+        return None
+    return dict(parse_qsl(urlparse(next_results).query))['max_id']
+
+
+class SearchQuery:
+    """ A single search query together with its since_id and the state of an
+    unfinished next_results pagination chain.
+    """
+
+    def __init__(self, query, geocode=None, lang=None, since_id=None, max_id=None, next_since_id=None):
+        self.query = query
+        self.geocode = geocode
+        self.lang = lang
+        self.since_id = since_id
+        self.max_id = max_id  # max_id of the next page of the chain, None when the chain is finished
+        self.next_since_id = next_since_id  # highest id seen in the chain so far
+        self.failures = 0  # failed writes of the pipeline when the chain started
+        self.score = 0.0  # moving average of new tweets per request
+        self.idle_wait = 0.0  # current pause after an empty result, grows while the query stays empty
+        self.last_run = 0.0
+        self.due = 0.0  # the query is not run before this time
+        self.busy = False
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(document['query'], document.get('geocode'), document.get('lang'), document.get('since_id'),
+                   document.get('max_id'), document.get('next_since_id'))
+
+    def key(self):
+        return {'query': self.query, 'geocode': self.geocode, 'lang': self.lang}
+
+    def __repr__(self):
+        return 'SearchQuery(' + repr(self.query) + ')'
+
+
+class RateBudget:
+    """ The search request budget shared by all threads issuing requests.
+
+    The budget follows the x-rate-limit-remaining and x-rate-limit-reset
+    headers of the responses: requests are issued without delay while the
+    window has requests left, and once it is used up acquire sleeps until the
+    window resets. Until the first response arrives a local sliding window of
+    `limit` requests per `window` seconds is used instead.
+    """
+
+    def __init__(self, limit=450, window=900):
+        self.limit = limit
+        self.window = window
+        self.calls = collections.deque()
+        self.remaining = None  # requests left in the current window, None when not known
+        self.reset = 0.0  # when the current window ends, in seconds since the epoch
+        self.lock = threading.Lock()
+
+    def update(self, remaining, reset):
+        """ Updates the budget from the rate limit headers of a response
+        """
+        with self.lock:
+            if reset is not None:
+                self.reset = float(reset)
+            if remaining is not None:
+                self.remaining = int(remaining)
+                # the headers supersede the local count of requests
+                self.calls.clear()
+
+    def exhausted(self, reset=None):
+        """ Marks the window as used up, until `reset` or for a minute if it is not known
+        """
+        self.update(0, reset if reset is not None else time.time() + 60)
+
+    def try_acquire(self):
+        """ Takes a request from the budget. Returns 0 if it was granted, otherwise
+        the number of seconds to wait before trying again.
+        """
+        with self.lock:
+            now = time.time()
+            if self.remaining is not None and self.reset <= now:
+                # a new window has started, its budget is known again after the next response
+                self.remaining = None
+            while self.calls and self.calls[0] <= now - self.window:
+                self.calls.popleft()
+            if self.remaining is None and len(self.calls) < self.limit:
+                self.calls.append(now)
+                return 0
+            if self.remaining is not None and self.remaining > 0:
+                self.remaining -= 1
+                return 0
+            if self.remaining is not None:
+                return self.reset - now + 1  # a second of slack for clock differences
+            return self.calls[0] + self.window - now
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            logger.info("Request budget used up, waiting " + str(int(wait)) + " seconds for the window to reset...")
+            time.sleep(wait)
+
+
+class QueryScheduler:
+    """ Hands out the query that should be run next.
+
+    A query's priority is its recent yield of new tweets multiplied by the time
+    since it last ran, so productive queries run more often while idle ones
+    still get their turn. A query that returned nothing is not run again for
+    `idle_wait` seconds, and the pause doubles with every further empty
+    result up to `max_idle_wait` seconds.
+    """
+
+    def __init__(self, queries, idle_wait=10.0, max_idle_wait=300.0, decay=0.5):
+        self.queries = list(queries)
+        self.idle_wait = idle_wait
+        self.max_idle_wait = max_idle_wait
+        self.decay = decay
+        self.condition = threading.Condition()
+
+    def poll(self):
+        """ Marks the query that should run next busy and returns it with None. When no
+        query is due returns None with the number of seconds until the next one is,
+        or None and None while all queries are busy.
+        """
+        with self.condition:
+            now = time.time()
+            ready = [q for q in self.queries if not q.busy and q.due <= now]
+            if ready:
+                query = max(ready, key=lambda q: (1.0 + q.score) * (now - q.last_run))
+                query.busy = True
+                return query, None
+            waiting = [q.due - now for q in self.queries if not q.busy]
+            return None, min(waiting) if waiting else None
+
+    def acquire(self, timeout=None):
+        """ Blocks until a query is due, marks it busy and returns it. Returns None
+        if no query was due within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                query, wait = self.poll()
+                if query:
+                    return query
+                if deadline is not None:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        return None
+                    wait = left if wait is None else min(wait, left)
+                self.condition.wait(wait)
+
+    def release(self, query, new_tweets):
+        with self.condition:
+            query.busy = False
+            query.last_run = time.time()
+            query.score = self.decay * query.score + (1.0 - self.decay) * new_tweets
+            if new_tweets == 0:
+                query.idle_wait = min(self.max_idle_wait, query.idle_wait * 2 or self.idle_wait)
+                query.due = query.last_run + query.idle_wait
+            else:
+                query.idle_wait = 0.0
+            self.condition.notify_all()
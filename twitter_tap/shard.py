@@ -0,0 +1,159 @@
+import json
+import logging
+import multiprocessing
+import signal
+import time
+
+import requests
+
+from . import metrics
+from .passthrough import PassthroughMixin, message_type, tweet_id
+
+logger = logging.getLogger('twitter')
+
+# limits of a single filter connection with the default access level
+MAX_TRACK = 400
+MAX_FOLLOW = 5000
+
+CREDENTIAL_KEYS = ['consumer_key', 'consumer_secret', 'access_token', 'access_token_secret']
+
+
+def load_credentials(filename):
+    """ Loads a JSON list of credential sets, each an object with the
+    consumer_key, consumer_secret, access_token and access_token_secret keys
+    """
+    with open(filename, 'r') as f:
+        credentials = json.load(f)
+    for number, credential in enumerate(credentials):
+        missing = [key for key in CREDENTIAL_KEYS if not credential.get(key)]
+        if missing:
+            raise ValueError("Credential set " + str(number) + " is missing " + ", ".join(missing))
+    return credentials
+
+
+def split_terms(terms, shards):
+    """ Splits a comma separated list of terms round-robin into `shards` comma separated lists
+    """
+    if not terms:
+        return [None] * shards
+    unique = []
+    for term in terms.split(','):
+        term = term.strip()
+        if term and term not in unique:
+            unique.append(term)
+    return [','.join(unique[i::shards]) or None for i in range(shards)]
+
+
+def shard_filters(track, follow, locations, shards):
+    """ Returns the filter parameters of every shard. Bounding boxes can not be
+    split without losing tweets on their borders, so they all go to the first shard.
+    """
+    filters = []
+    for number, (shard_track, shard_follow) in enumerate(zip(split_terms(track, shards), split_terms(follow, shards))):
+        if shard_track and len(shard_track.split(',')) > MAX_TRACK:
+            logger.warning("Shard " + str(number) + " tracks more than " + str(MAX_TRACK) + " keywords, use more shards.")
+        if shard_follow and len(shard_follow.split(',')) > MAX_FOLLOW:
+            logger.warning("Shard " + str(number) + " follows more than " + str(MAX_FOLLOW) + " users, use more shards.")
+        filters.append({'track': shard_track, 'follow': shard_follow, 'locations': locations if number == 0 else None})
+    # Twitter rejects a filter without parameters, a shard without terms would reconnect in a tight loop
+    used = [filter_params for filter_params in filters if any(filter_params.values())]
+    if len(used) < len(filters):
+        logger.warning("There are only terms for " + str(len(used)) + " of the " + str(len(filters)) +
+                       " shards, the others are not started.")
+    return used
+
+
+def run_shard(number, credentials, filter_params, output, passthrough=False, log_format=None, log_level=None):
+    """ Runs a filter stream in a worker process. Every tweet is put on the
+    `output` queue as a (shard number, tweet id, tweet) tuple, where the tweet is
+    the decoded dict or, with `passthrough`, the raw line.
+    """
+    from twython import TwythonStreamer
+
+    logging.basicConfig(format=log_format, level=log_level)
+    # the parent process stops the workers when it shuts down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    class ShardStreamer(TwythonStreamer):
+        def on_success(self, data):
+            if 'text' in data:
+                output.put((number, data['id'], data))
+            if 'limit' in data:
+                logger.warning("Shard " + str(number) + " has matched more Tweets than its current rate limit "
+                               "allows it to be delivered.")
+
+        def on_error(self, status_code, data, *args):
+            logger.error("Shard " + str(number) + " received error code " + str(status_code) + ".")
+
+    class PassthroughShardStreamer(PassthroughMixin, ShardStreamer):
+        def on_raw(self, line):
+            kind = message_type(line)
+            if kind == 'tweet':
+                output.put((number, tweet_id(line), line))
+            elif kind is not None:
+                self.on_success(json.loads(line.decode('utf-8')))
+
+    streamer = PassthroughShardStreamer if passthrough else ShardStreamer
+    stream = streamer(*[credentials[key] for key in CREDENTIAL_KEYS])
+    logger.info("Shard " + str(number) + " is tracking " + str(filter_params))
+    while True:
+        try:
+            stream.statuses.filter(**filter_params)
+        except requests.exceptions.ChunkedEncodingError as e:
+            logger.error("Shard " + str(number) + " lost its connection: " + str(e))
+            continue
+
+
+class ShardedStream:
+    """ Runs one filter connection per shard in its own worker process. The
+    workers decode the stream and feed a single queue which is consumed in
+    the parent process.
+    """
+
+    report_every = 60  # seconds between the per shard throughput log lines
+
+    def __init__(self, filters, credentials, maxsize=10000, passthrough=False, log_format=None, log_level=None):
+        # the workers are spawned rather than forked, as the parent already runs writer and MongoDB threads
+        context = multiprocessing.get_context('spawn')
+        self.output = context.Queue(maxsize)
+        self.workers = []
+        for number, filter_params in enumerate(filters):
+            worker = context.Process(target=run_shard, name='shard-' + str(number),
+                                     args=(number, credentials[number % len(credentials)], filter_params,
+                                           self.output, passthrough, log_format, log_level))
+            worker.daemon = True
+            self.workers.append(worker)
+        self.received = [0] * len(filters)
+        self.duplicates = [0] * len(filters)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+
+    def consume(self, handle, seen):
+        """ Passes every tweet that no other shard delivered before to `handle`
+        """
+        reported_at = time.time()
+        reported = list(self.received)
+        while True:
+            number, status_id, tweet = self.output.get()
+            self.received[number] += 1
+            metrics.RECEIVED.inc()
+            if seen.check_and_add(status_id):
+                self.duplicates[number] += 1
+            else:
+                handle(tweet)
+            now = time.time()
+            if now - reported_at >= self.report_every:
+                for shard, count in enumerate(self.received):
+                    logger.info("Shard " + str(shard) + ": " + "%.1f" % ((count - reported[shard]) / (now - reported_at)) +
+                                " tweets/s, " + str(count) + " received, " + str(self.duplicates[shard]) + " duplicates.")
+                reported_at = now
+                reported = list(self.received)
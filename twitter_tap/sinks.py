@@ -0,0 +1,138 @@
+import functools
+import threading
+
+from .matcher import topic
+from .storage import BatchWriter, bulk_upsert
+from .transform import convert_dates
+
+
+class Sink(object):
+    """ Where a collector stores the tweets. Subclasses implement write, and
+    write_many if a page of search results can be stored faster than one
+    tweet at a time.
+    """
+
+    def write(self, status):
+        raise NotImplementedError
+
+    def write_many(self, statuses):
+        for status in statuses:
+            self.write(status)
+
+    def write_raw(self, line):
+        """ Stores a tweet exactly as it was received from the stream
+        """
+        raise NotImplementedError(type(self).__name__ + " can't store raw tweets")
+
+    def close(self):
+        pass
+
+
+class MongoSink(Sink):
+    """ Stores the tweets in a MongoDB collection or a Partitioner. Streamed
+    tweets are inserted in batches of `batch_size`, pages of search results
+    are upserted by their id. With a SpoolingWriter as `spool` the tweets are
+    kept on disk while MongoDB is unavailable.
+    """
+
+    def __init__(self, collection, batch_size=500, batch_age=1.0, spool=None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.batch_age = batch_age
+        self.spool = spool
+        self.batch_writer = None
+        self.lock = threading.Lock()
+
+    def write(self, status):
+        if self.batch_writer is None:
+            # the batch writer starts a thread, a search never needs it
+            with self.lock:
+                if self.batch_writer is None:
+                    self.batch_writer = BatchWriter(self.collection, size=self.batch_size, max_age=self.batch_age,
+                                                    spool=self.spool)
+        self.batch_writer.write(convert_dates(status))
+
+    def write_many(self, statuses):
+        statuses = [convert_dates(status) for status in statuses]
+        if self.spool:
+            self.spool.write(statuses, functools.partial(bulk_upsert, self.collection))
+        else:
+            bulk_upsert(self.collection, statuses)
+
+    def depth(self):
+        return self.batch_writer.depth() if self.batch_writer else 0
+
+    def close(self):
+        if self.batch_writer:
+            self.batch_writer.close()
+        if self.spool:
+            self.spool.close()
+
+
+class FileSink(Sink):
+    """ Writes the tweets to the files of a Filer or ParquetFiler
+    """
+
+    def __init__(self, filer):
+        self.filer = filer
+
+    def write(self, status):
+        self.filer.emit(status)
+
+    def write_raw(self, line):
+        self.filer.emit_raw(line)
+
+    def close(self):
+        self.filer.close_file()
+
+
+class RoutingSink(Sink):
+    """ Routes the tweets tagged with matched_terms to a sink per topic, which
+    is opened with `open_sink(topic)` when the first tweet of the topic
+    arrives. A tweet matching several terms is stored in all of their topics,
+    tweets matching none of them go to the `default` sink.
+    """
+
+    def __init__(self, default, open_sink):
+        self.default = default
+        self.open_sink = open_sink
+        self.sinks = {}  # topic: sink
+        self.lock = threading.Lock()
+
+    def route(self, status):
+        """ Returns the sinks a tweet is stored in
+        """
+        topics = sorted(set(topic(term) for term in status.get('matched_terms') or []))
+        if not topics:
+            return [self.default]
+        sinks = []
+        for name in topics:
+            if name not in self.sinks:
+                with self.lock:
+                    if name not in self.sinks:
+                        self.sinks[name] = self.open_sink(name)
+            sinks.append(self.sinks[name])
+        return sinks
+
+    def write(self, status):
+        sinks = self.route(status)
+        for sink in sinks:
+            # every sink gets its own copy, MongoDB adds an _id to the tweets it inserts
+            sink.write(dict(status) if len(sinks) > 1 else status)
+
+    def write_many(self, statuses):
+        routed = {}
+        for status in statuses:
+            sinks = self.route(status)
+            for sink in sinks:
+                routed.setdefault(sink, []).append(dict(status) if len(sinks) > 1 else status)
+        for sink, batch in routed.items():
+            sink.write_many(batch)
+
+    def depth(self):
+        return sum(sink.depth() for sink in [self.default] + list(self.sinks.values()) if hasattr(sink, 'depth'))
+
+    def close(self):
+        self.default.close()
+        for sink in list(self.sinks.values()):
+            sink.close()
@@ -0,0 +1,135 @@
+import datetime
+import logging
+import os
+import threading
+import time
+
+from . import metrics
+from .filer import Filer, dumps
+from .loader import find_files, parse_file
+from .storage import UNAVAILABLE, bulk_upsert
+from .transform import format_datetime
+
+logger = logging.getLogger('twitter')
+
+
+def serialize(status):
+    """ Turns a tweet prepared for MongoDB back into the JSON of the Twitter API
+    """
+    status = dict(status)
+    status.pop('_id', None)  # added by insert_many
+    if isinstance(status.get('created_at'), datetime.datetime):
+        status['created_at'] = format_datetime(status['created_at'])
+    user = status.get('user')
+    if isinstance(user, dict) and isinstance(user.get('created_at'), datetime.datetime):
+        status['user'] = dict(user, created_at=format_datetime(user['created_at']))
+    return dumps(status)
+
+
+class SpoolingWriter:
+    """ Keeps the tweets on disk while MongoDB is down or too slow.
+
+    Writes go to MongoDB until one fails because MongoDB is unavailable,
+    then that batch and all the following ones are appended to segment
+    files in `directory`, in the same layout as the --output files. Every
+    `retry` seconds a background thread tries to upsert the spooled tweets
+    into the `collection`, deleting every segment once it is stored, and
+    writes go to MongoDB again as soon as one of them succeeds. Segments
+    left over from an earlier run are drained as well.
+    """
+
+    def __init__(self, collection, directory, retry=10.0, segment_size=10000, batch_size=5000):
+        self.collection = collection
+        self.directory = directory
+        self.retry = retry
+        self.batch_size = batch_size
+        self.filer = Filer(directory, segment_size, serializer=serialize, written=metrics.SPOOLED)
+        self.diverting = False
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.drainer = threading.Thread(target=self._drain, name='spool-drainer')
+        self.drainer.daemon = True
+
+    def start(self):
+        self.drainer.start()
+
+    def write(self, statuses, write):
+        """ Stores the statuses with `write`, a function writing them to MongoDB,
+        or appends them to the spool while MongoDB is unavailable
+        """
+        if not self.diverting:
+            try:
+                write(statuses)
+                return
+            except UNAVAILABLE as e:
+                with self.lock:
+                    if not self.diverting:
+                        logger.error("MongoDB is unavailable, spooling the tweets to " + self.directory + ": " + str(e))
+                    self.diverting = True
+        for status in statuses:
+            self.filer.emit(status)
+
+    def pending(self):
+        """ Returns the spool segments that are complete and can be drained, oldest first
+        """
+        return [path for path in find_files(self.directory) if path != self.filer.file_name]
+
+    def drain(self):
+        """ Upserts the spooled tweets into MongoDB and deletes their segments
+        """
+        with self.filer.lock:
+            if self.filer.counter:
+                # start a new segment, so the one with the tweets spooled so far can be drained
+                self.filer.close_file()
+                self.filer.new_file()
+        for path in self.pending():
+            if self.closed.is_set():
+                return
+            path, statuses, error = parse_file(path)
+            if error:
+                logger.error("Couldn't read the spooled tweets in " + path + ", it is kept: " + error)
+                continue
+            for start in range(0, len(statuses), self.batch_size):
+                bulk_upsert(self.collection, statuses[start:start + self.batch_size])
+                self.recovered()
+            os.remove(path)
+            if statuses:
+                logger.info("Stored " + str(len(statuses)) + " spooled tweets from " + path + ".")
+        self.recovered()
+
+    def recovered(self):
+        """ Sends the writes to MongoDB again, the spool is drained in the background
+        """
+        with self.lock:
+            if self.diverting:
+                logger.info("MongoDB is available again, draining the spool.")
+                self.diverting = False
+
+    def close(self):
+        self.closed.set()
+        if self.drainer.is_alive():
+            self.drainer.join()
+        with self.filer.lock:
+            self.filer.close_file()
+            if not os.path.getsize(self.filer.file_name):
+                os.remove(self.filer.file_name)
+        pending = find_files(self.directory)
+        if pending:
+            logger.warning(str(len(pending)) + " spool segments in " + self.directory +
+                           " are stored in MongoDB the next time tap runs with this --spool.")
+
+    def _drain(self):
+        while True:
+            if self.diverting or self.filer.counter or self.pending():
+                started = time.time()
+                try:
+                    self.drain()
+                except UNAVAILABLE as e:
+                    logger.warning("MongoDB is still unavailable, retrying in " + str(self.retry) +
+                                   " seconds: " + str(e))
+                except Exception as e:
+                    logger.error("Couldn't drain the spool: " + str(e))
+                else:
+                    logger.debug("Drained the spool in " + "%.1f" % (time.time() - started) + " seconds.")
+            if self.closed.wait(self.retry):
+                return
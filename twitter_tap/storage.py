@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout
+
+from . import metrics
+from .partition import routes
+
+logger = logging.getLogger('twitter')
+
+DUPLICATE_KEY_ERROR = 11000
+
+# errors of a MongoDB that is down, unreachable or too slow, the write can be retried later
+UNAVAILABLE = (ConnectionFailure, ExecutionTimeout)
+
+
+def only_duplicates(error):
+    """ Returns True if a BulkWriteError was caused by duplicate keys alone
+    """
+    details = error.details or {}
+    write_errors = details.get('writeErrors', [])
+    if details.get('writeConcernErrors'):
+        return False
+    return bool(write_errors) and all(e.get('code') == DUPLICATE_KEY_ERROR for e in write_errors)
+
+
+def bulk_upsert(collection, statuses):
+    """ Upserts a page of statuses by their id with a single unordered bulk_write
+    per collection, `collection` may be a Partitioner. Duplicate-key errors from
+    concurrent upserts of the same tweet are ignored.
+    """
+    if not statuses:
+        return
+    for part, group in routes(collection, statuses):
+        requests = [ReplaceOne({'id': status['id']}, status, upsert=True) for status in group]
+        try:
+            with metrics.WRITE_SECONDS.time():
+                part.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            if not only_duplicates(e):
+                raise
+            logger.debug("Skipped " + str(len(e.details['writeErrors'])) + " duplicate tweets.")
+        metrics.WRITTEN.inc(len(group))
+
+
+def report_insert(batch, started, error=None):
+    """ Logs and counts the outcome of an insert_many of `batch` that started at `started`
+    """
+    if error is None or isinstance(error, BulkWriteError):
+        metrics.WRITE_SECONDS.observe(time.time() - started)
+    if error is None:
+        metrics.WRITTEN.inc(len(batch))
+        logger.debug("Saved " + str(len(batch)) + " tweets.")
+    elif isinstance(error, BulkWriteError) and only_duplicates(error):
+        # the duplicates were stored before and are not counted again
+        metrics.WRITTEN.inc(len(batch) - len(error.details['writeErrors']))
+        logger.debug("Skipped " + str(len(error.details['writeErrors'])) + " duplicate tweets.")
+    elif isinstance(error, BulkWriteError):
+        failed = [err for err in error.details.get('writeErrors', []) if err.get('code') != DUPLICATE_KEY_ERROR]
+        metrics.WRITTEN.inc(len(batch) - len(error.details.get('writeErrors', [])))
+        metrics.WRITE_ERRORS.inc()
+        logger.error("Couldn't save " + str(len(failed)) + " tweets: " + str(failed[0]['errmsg'] if failed else error))
+    else:
+        metrics.WRITE_ERRORS.inc()
+        logger.error("Couldn't save a batch of " + str(len(batch)) + " tweets: " + str(error))
+
+
+class BatchWriter:
+    """ Collects tweets and inserts them with a single unordered insert_many
+    whenever the batch reaches `size` tweets or the oldest tweet in it is
+    older than `max_age` seconds. `collection` may be a Partitioner, then
+    there is one insert_many per collection. With a SpoolingWriter as `spool`
+    the batches MongoDB can't take are written to the spool instead.
+    """
+
+    def __init__(self, collection, size=500, max_age=1.0, spool=None):
+        self.collection = collection
+        self.spool = spool
+        self.size = size
+        self.max_age = max_age
+        self.buffer = []
+        self.started = None  # arrival time of the oldest buffered tweet
+        self.lock = threading.RLock()
+        self.closed = threading.Event()
+        # a quiet stream would otherwise keep tweets in the buffer indefinitely
+        self.flusher = threading.Thread(target=self._flush_stale)
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def write(self, doc):
+        with self.lock:
+            if not self.buffer:
+                self.started = time.time()
+            self.buffer.append(doc)
+            if len(self.buffer) >= self.size or time.time() - self.started >= self.max_age:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def depth(self):
+        return len(self.buffer)
+
+    def close(self):
+        self.closed.set()
+        self.flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        if self.spool:
+            self.spool.write(batch, self._insert)
+        else:
+            self._insert(batch)
+
+    def _insert(self, batch):
+        try:
+            parts = routes(self.collection, batch)
+        except Exception as e:
+            if self.spool and isinstance(e, UNAVAILABLE):
+                raise
+            report_insert(batch, time.time(), e)
+            return
+        for part, group in parts:
+            started = time.time()
+            try:
+                part.insert_many(group, ordered=False)
+            except Exception as e:
+                if self.spool and isinstance(e, UNAVAILABLE):
+                    # the whole batch is spooled, the tweets that were inserted are replaced when it is drained
+                    raise
+                report_insert(group, started, e)
+            else:
+                report_insert(group, started)
+
+    def _flush_stale(self):
+        while not self.closed.wait(self.max_age):
+            with self.lock:
+                if self.buffer and time.time() - self.started >= self.max_age:
+                    self._flush()
@@ -0,0 +1,115 @@
+from datetime import datetime
+from email.utils import parsedate
+from functools import lru_cache
+
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+MONTHS = dict((name, number) for number, name in enumerate(MONTH_NAMES, 1))
+DAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+@lru_cache(maxsize=4096)
+def parse_datetime(string):
+    """ Parses the created_at format of the Twitter API, e.g. "Wed Oct 10 20:19:24 +0000 2018",
+    by position. Anything else is left to email.utils.parsedate. Users and tweets from
+    the same second share the cached result.
+    """
+    try:
+        return datetime(int(string[26:30]), MONTHS[string[4:7]], int(string[8:10]),
+                        int(string[11:13]), int(string[14:16]), int(string[17:19]))
+    except (KeyError, ValueError):
+        return datetime(*(parsedate(string)[:6]))
+
+
+def format_datetime(value):
+    """ Formats a UTC datetime in the created_at format of the Twitter API, independent of the locale
+    """
+    return (DAY_NAMES[value.weekday()] + ' ' + MONTH_NAMES[value.month - 1] + ' ' +
+            value.strftime('%d %H:%M:%S +0000 ') + str(value.year))
+
+
+def convert_dates(status):
+    """ Converts the created_at fields of a tweet and its user to datetimes for MongoDB
+    """
+    if isinstance(status.get('created_at'), str):
+        status['created_at'] = parse_datetime(status['created_at'])
+    try:
+        # a routed tweet is converted once for every topic, but its copies share the user
+        if isinstance(status['user']['created_at'], str):
+            status['user']['created_at'] = parse_datetime(status['user']['created_at'])
+    except (KeyError, TypeError):
+        pass
+    return status
+
+
+class Projection:
+    """ Slims tweets down to the included field paths and drops the excluded
+    ones before they are stored. Paths are dotted ("user.screen_name") and are
+    applied to every element of the lists they pass through
+    ("entities.hashtags.text"). The id is always kept.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = _tree(list(include) + ['id']) if include else None
+        self.exclude = _tree(exclude) if exclude else None
+
+    @classmethod
+    def load(cls, filename):
+        """ Loads a projection from a file with one field path per line. Lines
+        starting with "-" are excluded fields, lines starting with "#" are comments.
+        """
+        include = []
+        exclude = []
+        with open(filename, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('-'):
+                    exclude.append(line[1:].strip())
+                else:
+                    include.append(line)
+        return cls(include, exclude)
+
+    def apply(self, status):
+        if self.include:
+            status = _include(status, self.include)
+        if self.exclude:
+            _exclude(status, self.exclude)
+        return status
+
+
+def _tree(paths):
+    tree = {}
+    for path in paths:
+        node = tree
+        keys = path.split('.')
+        for key in keys[:-1]:
+            if node.get(key) is True:
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = True
+    return tree
+
+
+def _include(value, tree):
+    if isinstance(value, dict):
+        return dict((key, value[key] if sub is True else _include(value[key], sub))
+                    for key, sub in tree.items() if key in value)
+    if isinstance(value, list):
+        return [_include(item, tree) for item in value]
+    return value
+
+
+def _exclude(value, tree):
+    if isinstance(value, dict):
+        for key, sub in tree.items():
+            if key not in value:
+                continue
+            if sub is True:
+                del value[key]
+            else:
+                _exclude(value[key], sub)
+    elif isinstance(value, list):
+        for item in value:
+            _exclude(item, tree)